@@ -6,6 +6,7 @@ from app.extensions import socketio
 from app.routes import register_blueprints
 from app.socket_handlers import register_handlers
 from app.services.file_manager import ensure_dirs, start_cleanup_scheduler
+from app.services import cpu_pool, storage, store
 from app.utils import setup_logging
 
 
@@ -20,6 +21,9 @@ def create_app():
 
     setup_logging()
     ensure_dirs()
+    if not cpu_pool.is_worker_process():
+        storage.migrate_flat()
+        store.init_db()
 
     # Init extensions
     socketio.init_app(app)
@@ -28,7 +32,9 @@ def create_app():
     register_blueprints(app)
     register_handlers()
 
-    # Start background cleanup
-    start_cleanup_scheduler()
+    # Background threads and pools belong to the serving process only
+    if not cpu_pool.is_worker_process():
+        start_cleanup_scheduler()
+        cpu_pool.start()
 
     return app
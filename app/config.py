@@ -10,6 +10,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 OUTPUT_FOLDER = os.path.join(BASE_DIR, 'output')
 PACKS_FOLDER = os.path.join(BASE_DIR, 'packs')
+PACK_BUILDS_FOLDER = os.path.join(PACKS_FOLDER, 'builds')  # per-pack build manifests
+DB_PATH = os.path.join(BASE_DIR, 'telesticker.db')  # SQLite sticker/job store
 
 # Telegram sticker specs
 MAX_IMAGE_SIZE = 512          # pixels - one side must be exactly 512
@@ -23,17 +25,59 @@ CUSTOM_EMOJI_SIZE = 100       # pixels for custom emoji mode
 
 # Upload limits
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max upload
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested chunk size for resumable uploads
+MAX_CHUNKED_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024  # 2GB max resumable upload
+UPLOAD_SESSION_TTL_HOURS = 6  # idle resumable uploads are forgotten after this
+MAX_ARCHIVE_MEMBERS = 1000    # media files accepted from one uploaded ZIP
+MAX_ARCHIVE_EXTRACT_MB = 2048  # total uncompressed media size accepted from one ZIP
+STICKERS_PAGE_SIZE = 100      # default /api/stickers page size
+STICKERS_MAX_PAGE_SIZE = 500
+PACKS_PAGE_SIZE = 50          # default /api/pack page size
+PACKS_MAX_PAGE_SIZE = 500
+PACK_INDEX_RECHECK_SECONDS = 5  # how often the pack index re-stats PACKS_FOLDER
+PACK_FLUSH_DELAY_SECONDS = 1.0  # write-behind window; pack edits within it are merged
 
 # Processing
-MAX_WORKERS = 3               # ThreadPoolExecutor workers
+MAX_WORKERS = max(3, os.cpu_count() or 1)  # shared per-file task workers
+JOB_MAX_CONCURRENCY = max(1, MAX_WORKERS // 2)  # files one job may run at once
+ANALYSIS_WORKERS = MAX_WORKERS  # background post-upload thumbnail/probe workers
+EXECUTOR_BACKEND = 'process'  # 'process' or 'thread' for CPU-bound image work
+CPU_WORKERS = os.cpu_count() or 1  # process pool size
 VIDEO_TIMEOUT = 120           # seconds before video conversion times out
-CLEANUP_INTERVAL_HOURS = 1    # how often to run file cleanup
-FILE_MAX_AGE_HOURS = 24       # delete files older than this
+MAX_VIDEO_ATTEMPTS = 3        # two-pass encodes tried before giving up on the size limit
+MIN_VIDEO_BITRATE_KBPS = 30   # floor for predicted/retry bitrates
+VIDEO_SIZE_HEADROOM = 0.9     # fraction of the size budget targeted (container overhead)
+PROBE_CACHE_MAX_ENTRIES = 4096  # memoized ffprobe results
+FFMPEG_MAX_PROCESSES = max(1, (os.cpu_count() or 1) // 2)  # concurrent ffmpeg/ffprobe subprocesses
+FFMPEG_THREADS = max(1, (os.cpu_count() or 1) // FFMPEG_MAX_PROCESSES)  # encoder threads per slot
+PROGRESS_EMIT_INTERVAL = 0.5  # min seconds between live encode progress events per file
+CLEANUP_TICK_SECONDS = 30     # seconds between incremental eviction ticks
+CLEANUP_SCAN_BATCH = 2000     # directory entries indexed per tick
+CLEANUP_EVICT_BATCH = 200     # files evicted per tick at most
+CLEANUP_REFERENCE_TTL_SECONDS = 300  # reference provider results reused for this long
+FILE_MAX_AGE_HOURS = 24       # evict unreferenced files idle longer than this
+STORAGE_QUOTA_MB = 5120       # uploads + output byte quota (LRU-evicted beyond)
+STORAGE_SHARD_CHARS = 2       # hex chars of shard directory names (16**n shards per folder)
+STICKER_STORE_MAX_ENTRIES = 20000  # in-memory sticker records (LRU beyond this)
+JOB_STORE_MAX_ENTRIES = 2000  # in-memory job records (finished jobs evicted first)
+ENCODER_VERSION = 2           # bump when output encoding changes (invalidates output cache)
+OUTPUT_CACHE_MAX_MB = 1024    # processed-output cache byte budget (LRU)
+OUTPUT_CACHE_MAX_ENTRIES = 10000
+
+# Telegram Bot API client
+# Bot API endpoint; set TELEGRAM_API_BASE to point at a local Bot API server
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+TELEGRAM_HTTP2 = False        # use HTTP/2 when the h2 package is installed
+TELEGRAM_MAX_CONNECTIONS = 10  # pooled connections to the Bot API
+TELEGRAM_MAX_KEEPALIVE = 5    # idle connections kept open
+TELEGRAM_KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept
+TELEGRAM_CREATE_SET_MAX_STICKERS = 50  # InputStickers sent in the createNewStickerSet call itself
 
 # Supported file types
 IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'tiff'}
 VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'wmv', 'webm', 'mkv'}
 ANIMATED_EXTENSIONS = {'gif'}
+ARCHIVE_EXTENSIONS = {'zip'}
 
 # Flask config
 SECRET_KEY = 'telesticker_secret_key_v2'
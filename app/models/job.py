@@ -14,6 +14,8 @@ class Job:
     error_message: str = ''
     zip_path: Optional[str] = None
     cancelled: bool = False
+    session_id: str = ''
+    created_at: float = 0.0
 
     @property
     def progress(self):
@@ -30,4 +32,5 @@ class Job:
             'progress': self.progress,
             'file_results': self.file_results,
             'error_message': self.error_message,
+            'created_at': self.created_at,
         }
@@ -1,7 +1,7 @@
 """Sticker data model."""
 
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Optional, List, Dict, Any
 
 
 @dataclass
@@ -23,6 +23,12 @@ class Sticker:
     has_transparency: bool = False
     status: str = 'uploaded'  # uploaded, processing, processed, error
     error_message: str = ''
+    thumbnail_url: Optional[str] = None
+    warnings: List[str] = field(default_factory=list)
+    probe: Optional[Dict[str, Any]] = None  # cached probe_video result
+    content_hash: str = ''  # sha256 of upload_path, when known
+    session_id: str = ''
+    created_at: float = 0.0
 
     def to_dict(self):
         return {
@@ -41,4 +47,7 @@ class Sticker:
             'use_bg_removed': self.use_bg_removed,
             'status': self.status,
             'error_message': self.error_message,
+            'thumbnail_url': self.thumbnail_url,
+            'warnings': self.warnings,
+            'created_at': self.created_at,
         }
@@ -7,6 +7,7 @@ from app.routes.preview import preview_bp
 from app.routes.editor import editor_bp
 from app.routes.telegram import telegram_bp
 from app.routes.pack import pack_bp
+from app.routes.stats import stats_bp
 
 
 def register_blueprints(app):
@@ -17,3 +18,4 @@ def register_blueprints(app):
     app.register_blueprint(editor_bp)
     app.register_blueprint(telegram_bp)
     app.register_blueprint(pack_bp)
+    app.register_blueprint(stats_bp)
@@ -1,11 +1,13 @@
 """Download routes for processed files."""
 
+import os
 from flask import Blueprint, send_from_directory
-from app.config import OUTPUT_FOLDER
+from app.services import storage
 
 download_bp = Blueprint('download', __name__, url_prefix='/api')
 
 
 @download_bp.route('/download/<filename>')
 def download_file(filename):
-    return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
+    path = storage.output_path(filename, create=False)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), as_attachment=True)
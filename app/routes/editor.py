@@ -1,12 +1,11 @@
 """Editor routes — background removal, crop, etc."""
 
-import os
 from flask import Blueprint, request, jsonify
-from app.config import UPLOAD_FOLDER
+from app.services import storage
 from app.services.background_remover import (
     is_available, remove_background, remove_background_preview, get_available_models
 )
-from app.routes.upload import get_sticker
+from app.services.store import get_sticker, save_sticker
 
 editor_bp = Blueprint('editor', __name__, url_prefix='/api/editor')
 
@@ -23,7 +22,7 @@ def remove_bg():
     if not sticker:
         return jsonify({'error': 'Sticker not found'}), 404
 
-    if sticker['file_type'] != 'image':
+    if sticker.file_type != 'image':
         return jsonify({'error': 'Background removal only works on images'}), 400
 
     # User-adjustable settings
@@ -33,8 +32,8 @@ def remove_bg():
     bg_threshold = int(data.get('bg_threshold', 20))
     erode_size = int(data.get('erode_size', 15))
 
-    input_path = sticker['upload_path']
-    output_path = os.path.join(UPLOAD_FOLDER, f'{file_id}_nobg.png')
+    input_path = sticker.upload_path
+    output_path = storage.upload_path(f'{file_id}_nobg.png')
 
     result = remove_background(
         input_path, output_path,
@@ -45,8 +44,9 @@ def remove_bg():
         erode_size=erode_size,
     )
     if result:
-        sticker['bg_removed_path'] = result
-        sticker['use_bg_removed'] = True
+        sticker.bg_removed_path = result
+        sticker.use_bg_removed = True
+        save_sticker(sticker)
         thumb_name = f'{file_id}_nobg.png'
         return jsonify({
             'ok': True,
@@ -75,7 +75,7 @@ def remove_bg_preview():
     erode_size = int(data.get('erode_size', 15))
 
     preview = remove_background_preview(
-        sticker['upload_path'],
+        sticker.upload_path,
         model=model,
         alpha_matting=alpha_matting,
         fg_threshold=fg_threshold,
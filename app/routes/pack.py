@@ -1,14 +1,31 @@
 """Pack management routes."""
 
 from flask import Blueprint, request, jsonify
-from app.services.pack_manager import list_packs, get_pack, create_pack, update_pack, delete_pack
+from app.config import PACKS_PAGE_SIZE, PACKS_MAX_PAGE_SIZE
+from app.services.pack_manager import query_packs, get_pack, create_pack, update_pack, delete_pack
+from app.services.pack_builder import build_pack, load_manifest, discard_manifest
 
 pack_bp = Blueprint('pack', __name__, url_prefix='/api/pack')
 
 
 @pack_bp.route('', methods=['GET'])
 def list_all():
-    return jsonify({'packs': list_packs()})
+    """List packs one page at a time.
+
+    Query params: sort ('updated_at', 'created_at' or 'name'), order
+    ('asc'/'desc'; newest or A-Z first by default), offset, limit.
+    """
+    sort = request.args.get('sort', 'updated_at')
+    default_order = 'asc' if sort == 'name' else 'desc'
+    descending = request.args.get('order', default_order) == 'desc'
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', PACKS_PAGE_SIZE)), PACKS_MAX_PAGE_SIZE))
+        packs, total = query_packs(sort, descending, offset, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    next_offset = offset + len(packs) if offset + len(packs) < total else None
+    return jsonify({'packs': packs, 'total': total, 'next_offset': next_offset})
 
 
 @pack_bp.route('', methods=['POST'])
@@ -45,5 +62,32 @@ def update(pack_id):
 @pack_bp.route('/<pack_id>', methods=['DELETE'])
 def delete(pack_id):
     if delete_pack(pack_id):
+        discard_manifest(pack_id)
         return jsonify({'ok': True})
     return jsonify({'error': 'Pack not found'}), 404
+
+
+@pack_bp.route('/<pack_id>/build', methods=['POST'])
+def build(pack_id):
+    """Render the pack's stickers and icon (only those changed since the last
+    build) and bundle them into a downloadable ZIP."""
+    try:
+        result = build_pack(pack_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if result is None:
+        return jsonify({'error': 'Pack not found'}), 404
+    return jsonify(result)
+
+
+@pack_bp.route('/<pack_id>/build', methods=['GET'])
+def build_status(pack_id):
+    """The manifest of the pack's last build."""
+    if not get_pack(pack_id):
+        return jsonify({'error': 'Pack not found'}), 404
+    manifest = load_manifest(pack_id)
+    if not manifest:
+        return jsonify({'error': 'Pack has not been built'}), 404
+    return jsonify(dict(manifest, download_url=f'/api/download/{manifest["zip_name"]}'))
@@ -0,0 +1,16 @@
+"""Runtime statistics for monitoring."""
+
+from flask import Blueprint, jsonify
+from app.services import output_cache, ffmpeg_runner, store, file_manager
+
+stats_bp = Blueprint('stats', __name__, url_prefix='/api')
+
+
+@stats_bp.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        'output_cache': output_cache.get_stats(),
+        'ffmpeg': ffmpeg_runner.get_stats(),
+        'storage': file_manager.get_stats(),
+        **store.get_stats(),
+    })
@@ -2,7 +2,8 @@
 
 from flask import Blueprint, request, jsonify
 from app.services.telegram_api import validate_token, create_sticker_set, add_sticker_to_set, get_sticker_set
-from app.routes.upload import get_sticker
+from app.services.store import get_sticker
+from app.services.file_manager import pinned
 from app.config import OUTPUT_FOLDER
 import os
 
@@ -45,11 +46,11 @@ def create_set():
             continue
 
         # Use processed path if available, otherwise upload path
-        file_path = sticker.get('processed_path') or sticker.get('upload_path')
+        file_path = sticker.processed_path or sticker.upload_path
         if not file_path or not os.path.exists(file_path):
             continue
 
-        fmt = 'video' if sticker['file_type'] in ('video', 'animated_gif') else 'static'
+        fmt = 'video' if sticker.file_type in ('video', 'animated_gif') else 'static'
         stickers.append({
             'file_path': file_path,
             'emoji': sc.get('emoji', '🎨'),
@@ -59,7 +60,8 @@ def create_set():
     if not stickers:
         return jsonify({'error': 'No valid stickers to upload'}), 400
 
-    result = create_sticker_set(token, user_id, name, title, stickers)
+    with pinned([s['file_path'] for s in stickers]):
+        result = create_sticker_set(token, user_id, name, title, stickers)
     return jsonify(result)
 
 
@@ -77,14 +79,15 @@ def add_sticker():
     if not sticker:
         return jsonify({'error': 'Sticker not found'}), 404
 
-    file_path = sticker.get('processed_path') or sticker.get('upload_path')
-    fmt = 'video' if sticker['file_type'] in ('video', 'animated_gif') else 'static'
+    file_path = sticker.processed_path or sticker.upload_path
+    fmt = 'video' if sticker.file_type in ('video', 'animated_gif') else 'static'
 
-    result = add_sticker_to_set(token, user_id, name, {
-        'file_path': file_path,
-        'emoji': emoji,
-        'format': fmt,
-    })
+    with pinned([file_path]):
+        result = add_sticker_to_set(token, user_id, name, {
+            'file_path': file_path,
+            'emoji': emoji,
+            'format': fmt,
+        })
     return jsonify(result)
 
 
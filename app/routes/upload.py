@@ -1,38 +1,54 @@
 """Upload and processing routes."""
 
 import os
+import json
 import uuid
+import base64
+import hashlib
 from flask import Blueprint, request, jsonify
 from werkzeug.utils import secure_filename
-from app.config import UPLOAD_FOLDER, OUTPUT_FOLDER
-from app.utils import detect_file_type, validate_file, is_animated_gif
-from app.services.image_processor import generate_thumbnail, detect_transparency, get_image_info
-from app.services.video_processor import generate_video_thumbnail, probe_video
-from app.services.job_queue import submit_job, get_job, cancel_job
+from app.config import (
+    UPLOAD_FOLDER, OUTPUT_FOLDER, UPLOAD_CHUNK_SIZE, STICKERS_PAGE_SIZE, STICKERS_MAX_PAGE_SIZE
+)
+from app.models.sticker import Sticker
+from app.utils import detect_file_type, validate_file, get_session_id
+from app.services import chunked_upload, dedup, storage
+from app.services.file_manager import request_sweep
+from app.services.archive_ingest import is_archive, extract_archive
+from app.services.upload_analyzer import submit_analysis
+from app.services.job_queue import submit_job, cancel_job
+from app.services.store import (
+    get_sticker, get_all_stickers, save_sticker, delete_sticker as remove_sticker, get_job,
+    sticker_change_token, sticker_files
+)
 from app.extensions import socketio
 
 upload_bp = Blueprint('upload', __name__, url_prefix='/api')
 
-# In-memory sticker store (keyed by file_id)
-_stickers = {}
-
-
-def get_sticker(file_id):
-    return _stickers.get(file_id)
-
-
-def get_all_stickers():
-    return _stickers
+# Default /api/stickers projection: no filesystem paths or warnings
+STICKER_LIST_FIELDS = {
+    'file_id', 'original_filename', 'file_type', 'thumbnail_url', 'output_format', 'mode',
+    'emoji', 'file_size', 'width', 'height', 'has_transparency', 'use_bg_removed', 'status',
+    'created_at',
+}
 
 
 @upload_bp.route('/upload', methods=['POST'])
 def upload_files():
-    """Upload files without processing — returns metadata + thumbnails."""
+    """Upload files without processing — returns file records right away.
+
+    ZIP archives are accepted too; their media members become stickers.
+
+    Stickers start as 'analyzing'; thumbnails and metadata are filled in by
+    background analysis, which emits file_analyzed per file.
+    """
+    registered, saved = [], []
     try:
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-        results = []
+        session_id = get_session_id()
+        sid = request.args.get('sid') or request.form.get('sid')
 
         for key in request.files:
             files = request.files.getlist(key)
@@ -41,67 +57,190 @@ def upload_files():
                     continue
 
                 filename = secure_filename(file.filename)
+                if is_archive(filename):
+                    _ingest_archive(file.stream, filename, session_id, sid, registered, saved)
+                    continue
+
                 valid, warnings = validate_file(filename)
                 if not valid:
                     continue
 
                 file_id = str(uuid.uuid4())
                 save_name = f'{file_id}_{filename}'
-                save_path = os.path.join(UPLOAD_FOLDER, save_name)
-                file.save(save_path)
-
-                file_type = detect_file_type(filename)
-                file_size = os.path.getsize(save_path)
-
-                # Check if it's an animated GIF
-                if file_type == 'image' and filename.lower().endswith('.gif') and is_animated_gif(save_path):
-                    file_type = 'animated_gif'
-
-                # Generate thumbnail
-                thumb_name = f'{file_id}_thumb.webp'
-                thumb_path = os.path.join(UPLOAD_FOLDER, thumb_name)
-                thumb_url = None
-
-                info = {}
-                has_transparency = False
-
-                if file_type in ('image', 'animated_gif'):
-                    if generate_thumbnail(save_path, thumb_path):
-                        thumb_url = f'/api/preview/{thumb_name}'
-                    info = get_image_info(save_path) or {}
-                    has_transparency = detect_transparency(save_path)
-                elif file_type == 'video':
-                    video_thumb = thumb_path.rsplit('.', 1)[0] + '.jpg'
-                    if generate_video_thumbnail(save_path, video_thumb):
-                        thumb_name = os.path.basename(video_thumb)
-                        thumb_url = f'/api/preview/{thumb_name}'
-                    info = probe_video(save_path)
-
-                sticker_data = {
-                    'file_id': file_id,
-                    'original_filename': filename,
-                    'file_type': file_type,
-                    'upload_path': save_path,
-                    'thumbnail_url': thumb_url,
-                    'file_size': file_size,
-                    'width': info.get('width', 0),
-                    'height': info.get('height', 0),
-                    'has_transparency': has_transparency,
-                    'warnings': warnings,
-                    'output_format': 'webp',
-                    'mode': 'sticker',
-                    'status': 'uploaded',
-                }
-                _stickers[file_id] = sticker_data
-                results.append(sticker_data)
-
-        if not results:
-            return jsonify({'error': 'No valid files uploaded'}), 400
-
-        return jsonify({'files': results})
+                save_path = storage.upload_path(save_name)
+                saved.append(save_path)
+                content_hash = dedup.save_stream(file.stream, save_path)
+
+                registered.append(_register_upload(file_id, filename, save_path, warnings, session_id,
+                                                   content_hash))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        # All or nothing: don't leave earlier files of the request 'analyzing' with no analysis queued
+        _discard_uploads(registered, saved)
+        return jsonify({'error': str(e)}), 400 if isinstance(e, ValueError) else 500
+
+    if not registered:
+        return jsonify({'error': 'No valid files uploaded'}), 400
+
+    # Thumbnails and probes arrive later as file_analyzed events
+    for sticker in registered:
+        if sticker.status == 'analyzing':
+            submit_analysis(sticker, socketio, sid=sid)
+    request_sweep()
+
+    return jsonify({'files': [sticker.to_dict() for sticker in registered]})
+
+
+def _discard_uploads(stickers, paths):
+    """Delete the records and files of stickers registered by a failed request,
+    and the files it stored without registering them."""
+    paths = set(paths)
+    for sticker in stickers:
+        remove_sticker(sticker.file_id)
+        paths.update(sticker_files(sticker))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _ingest_archive(source, archive_name, session_id, sid, registered, saved):
+    """Register each media member of an uploaded ZIP as a sticker, emitting
+    archive_progress as members land on disk.
+
+    Member paths are appended to saved and their stickers to registered as
+    they are stored, so the caller can roll back a failure part-way.
+    """
+    def on_member(index, total, filename):
+        data = {'archive': archive_name, 'index': index, 'total': total, 'filename': filename}
+        if sid:
+            socketio.emit('archive_progress', data, to=sid)
+        else:
+            socketio.emit('archive_progress', data)
+
+    members = extract_archive(source, on_member=on_member)
+    saved.extend(m['path'] for m in members)
+    for m in members:
+        registered.append(_register_upload(m['file_id'], m['filename'], m['path'], m['warnings'],
+                                           session_id, m['content_hash']))
+
+
+def _register_upload(file_id, filename, save_path, warnings, session_id, content_hash=''):
+    """Record a stored upload as a sticker.
+
+    Duplicates of existing content share its bytes and analysis and come back
+    'uploaded'; everything else is 'analyzing' until submit_analysis runs.
+    """
+    sticker = Sticker(
+        file_id=file_id,
+        original_filename=filename,
+        file_type=detect_file_type(filename),
+        upload_path=save_path,
+        file_size=os.path.getsize(save_path),
+        status='analyzing',
+        warnings=warnings,
+        content_hash=content_hash,
+        session_id=session_id,
+    )
+    dedup.share_existing(sticker)
+    return save_sticker(sticker)
+
+
+@upload_bp.route('/upload/init', methods=['POST'])
+def upload_init():
+    """Open a resumable upload. Body: {filename, size}."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    valid, _ = validate_file(filename) if filename else (False, [])
+    if not valid and not is_archive(filename):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    try:
+        upload = chunked_upload.create_upload(filename, int(data.get('size', -1)), session_id=get_session_id())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(upload.to_dict(), chunk_size=UPLOAD_CHUNK_SIZE))
+
+
+@upload_bp.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Acknowledged offset of a resumable upload, to resume from."""
+    upload = chunked_upload.get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload.to_dict())
+
+
+@upload_bp.route('/upload/<upload_id>', methods=['PUT'])
+def upload_append(upload_id):
+    """Append the raw request body at the Upload-Offset header (or ?offset=)."""
+    upload = chunked_upload.get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', -1)))
+        new_offset = chunked_upload.append_chunk(upload, offset, request.stream)
+    except chunked_upload.UploadConflict as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e), 'offset': upload.offset}), 400
+    except Exception as e:
+        # Client went away mid-chunk; whatever was acknowledged is kept
+        return jsonify({'error': str(e), 'offset': upload.offset}), 400
+    return jsonify({'offset': new_offset, 'size': upload.size})
+
+
+@upload_bp.route('/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    """Finish a resumable upload and register it like a regular one.
+
+    Optional body: {sha256, sid}; sha256 is checked against the received bytes.
+    """
+    upload = chunked_upload.get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        digest = chunked_upload.finish_upload(upload, sha256=data.get('sha256'))
+    except chunked_upload.UploadConflict as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    sid = request.args.get('sid') or data.get('sid')
+    stickers, saved = [], []
+    try:
+        if is_archive(upload.filename):
+            try:
+                _ingest_archive(upload.path, upload.filename, upload.session_id, sid, stickers, saved)
+            finally:
+                os.remove(upload.path)
+        else:
+            saved.append(upload.path)
+            _, warnings = validate_file(upload.filename, upload.size)
+            stickers.append(_register_upload(upload.file_id, upload.filename, upload.path, warnings,
+                                             upload.session_id, content_hash=digest))
+    except Exception as e:
+        _discard_uploads(stickers, saved)
+        return jsonify({'error': str(e)}), 400 if isinstance(e, ValueError) else 500
+
+    if not stickers:
+        return jsonify({'error': 'No valid files uploaded'}), 400
+
+    for sticker in stickers:
+        if sticker.status == 'analyzing':
+            submit_analysis(sticker, socketio, sid=sid)
+    request_sweep()
+    return jsonify({'files': [s.to_dict() for s in stickers], 'sha256': digest})
+
+
+@upload_bp.route('/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    upload = chunked_upload.get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    chunked_upload.abort_upload(upload)
+    return jsonify({'ok': True})
 
 
 @upload_bp.route('/process', methods=['POST'])
@@ -117,20 +256,24 @@ def process_files():
         configs = []
         for fc in file_configs:
             file_id = fc.get('file_id')
-            sticker = _stickers.get(file_id)
+            sticker = get_sticker(file_id)
             if not sticker:
                 continue
 
             # Apply per-file overrides
-            sticker['output_format'] = fc.get('output_format', sticker.get('output_format', 'webp'))
-            sticker['mode'] = fc.get('mode', sticker.get('mode', 'sticker'))
+            sticker.output_format = fc.get('output_format', sticker.output_format)
+            sticker.mode = fc.get('mode', sticker.mode)
+            sticker.status = 'processing'
+            save_sticker(sticker)
 
             configs.append({
                 'file_id': file_id,
-                'upload_path': sticker['upload_path'],
-                'file_type': sticker['file_type'],
-                'output_format': sticker['output_format'],
-                'mode': sticker['mode'],
+                'upload_path': sticker.upload_path,
+                'file_type': sticker.file_type,
+                'output_format': sticker.output_format,
+                'mode': sticker.mode,
+                'probe': sticker.probe,
+                'content_hash': sticker.content_hash,
             })
 
         if not configs:
@@ -138,7 +281,7 @@ def process_files():
 
         # Get requesting client's SID for targeted emit
         sid = request.args.get('sid') or data.get('sid')
-        job_id = submit_job(configs, socketio, sid=sid)
+        job_id = submit_job(configs, socketio, sid=sid, session_id=get_session_id())
 
         return jsonify({'job_id': job_id, 'message': f'Processing {len(configs)} files'})
 
@@ -163,19 +306,71 @@ def cancel(job_id):
 
 @upload_bp.route('/stickers', methods=['GET'])
 def list_stickers():
-    """Return all uploaded stickers."""
-    return jsonify({'stickers': list(_stickers.values())})
+    """List uploaded stickers, one page at a time.
+
+    Query params: status, file_type, session ('current' for the caller's own),
+    cursor (from next_cursor), limit, fields (comma-separated projection).
+    Sends 304 when If-None-Match matches the current change token.
+    """
+    token = sticker_change_token()
+    etag = f'{token}-{hashlib.sha1(request.query_string).hexdigest()[:12]}'
+    if request.if_none_match.contains(etag):
+        return '', 304
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', STICKERS_PAGE_SIZE)), STICKERS_MAX_PAGE_SIZE))
+        after = _decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    session_id = request.args.get('session')
+    if session_id == 'current':
+        session_id = get_session_id()
+
+    # Fetch one extra row to know whether another page exists
+    stickers = get_all_stickers(
+        session_id=session_id,
+        status=request.args.get('status'),
+        file_type=request.args.get('file_type'),
+        after=after,
+        limit=limit + 1,
+    )
+    has_more = len(stickers) > limit
+    stickers = stickers[:limit]
+
+    fields = request.args.get('fields')
+    fields = set(fields.split(',')) if fields else STICKER_LIST_FIELDS
+    items = [{k: v for k, v in s.to_dict().items() if k in fields} for s in stickers]
+
+    next_cursor = _encode_cursor(stickers[-1]) if has_more else None
+    response = jsonify({'stickers': items, 'next_cursor': next_cursor, 'change_token': token})
+    response.set_etag(etag)
+    return response
+
+
+def _encode_cursor(sticker):
+    raw = json.dumps([sticker.created_at, sticker.file_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        created_at, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(created_at), str(file_id)
+    except Exception:
+        raise ValueError('bad cursor')
 
 
 @upload_bp.route('/sticker/<file_id>', methods=['DELETE'])
 def delete_sticker(file_id):
     """Remove an uploaded sticker."""
-    sticker = _stickers.pop(file_id, None)
+    sticker = remove_sticker(file_id)
     if not sticker:
         return jsonify({'error': 'Not found'}), 404
     # Clean up files
-    for key in ('upload_path', 'processed_path', 'bg_removed_path'):
-        path = sticker.get(key)
+    for path in (sticker.upload_path, sticker.processed_path, sticker.bg_removed_path):
         if path and os.path.exists(path):
             try:
                 os.remove(path)
@@ -0,0 +1,84 @@
+"""Archive ingest — stream media members of an uploaded ZIP into UPLOAD_FOLDER.
+
+Each supported member is decompressed straight to its final upload path
+(hashing it on the way, as for regular uploads); nothing is unpacked to a
+temporary tree first. Directory entries, hidden files, macOS resource forks
+and unsupported extensions are skipped.
+"""
+
+import os
+import uuid
+import logging
+import zipfile
+from pathlib import Path
+from werkzeug.utils import secure_filename
+from app.config import ARCHIVE_EXTENSIONS, MAX_ARCHIVE_MEMBERS, MAX_ARCHIVE_EXTRACT_MB
+from app.services import dedup, storage
+from app.utils import validate_file
+
+logger = logging.getLogger('telesticker.archive')
+
+
+def is_archive(filename):
+    return Path(filename).suffix.lower().lstrip('.') in ARCHIVE_EXTENSIONS
+
+
+def _media_members(zf):
+    """(ZipInfo, safe filename, warnings) for each supported media member."""
+    members = []
+    for info in zf.infolist():
+        parts = info.filename.replace('\\', '/').split('/')
+        if info.is_dir() or '__MACOSX' in parts or parts[-1].startswith('.'):
+            continue
+        filename = secure_filename(parts[-1])
+        valid, warnings = validate_file(filename, info.file_size)
+        if filename and valid:
+            members.append((info, filename, warnings))
+    return members
+
+
+def extract_archive(fileobj, on_member=None):
+    """Extract the media members of a ZIP (path or seekable file object).
+
+    Returns a list of dicts with file_id, filename, path, content_hash and
+    warnings. on_member(index, total, filename) is called after each member
+    is on disk. Raises ValueError for unreadable or oversized archives.
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError(f'Invalid ZIP archive: {e}')
+
+    with zf:
+        members = _media_members(zf)
+        if len(members) > MAX_ARCHIVE_MEMBERS:
+            raise ValueError(f'Archive has {len(members)} media files (max {MAX_ARCHIVE_MEMBERS})')
+        # ZipExtFile never yields more than the declared size, so this bounds the extract
+        total_bytes = sum(info.file_size for info, _, _ in members)
+        if total_bytes > MAX_ARCHIVE_EXTRACT_MB * 1024 * 1024:
+            raise ValueError(f'Archive expands to more than {MAX_ARCHIVE_EXTRACT_MB}MB')
+
+        extracted = []
+        for index, (info, filename, warnings) in enumerate(members):
+            file_id = str(uuid.uuid4())
+            save_path = storage.upload_path(f'{file_id}_{filename}')
+            try:
+                with zf.open(info) as src:
+                    content_hash = dedup.save_stream(src, save_path)
+            except Exception as e:
+                logger.warning(f'Skipping archive member {info.filename}: {e}')
+                if os.path.exists(save_path):
+                    os.remove(save_path)
+                continue
+            extracted.append({
+                'file_id': file_id,
+                'filename': filename,
+                'path': save_path,
+                'content_hash': content_hash,
+                'warnings': warnings,
+            })
+            if on_member:
+                on_member(index + 1, len(members), filename)
+
+    logger.info(f'Extracted {len(extracted)} of {len(members)} media files from archive')
+    return extracted
@@ -4,6 +4,7 @@ import os
 import io
 import base64
 import logging
+from app.services import cpu_pool
 
 logger = logging.getLogger('telesticker.bg')
 
@@ -39,10 +40,20 @@ def _get_session(model=None):
 
 def _refine_alpha(result):
     """Refine alpha: only feather the edges, keep solid foreground fully opaque."""
+    from PIL import Image
+
+    alpha = result.split()[-1]
+    refined = cpu_pool.run(_refine_alpha_band, alpha.tobytes(), alpha.size)
+    result.putalpha(Image.frombytes('L', alpha.size, refined))
+    return result
+
+
+def _refine_alpha_band(data, size):
+    """Pool-side alpha refinement on a raw 8-bit alpha plane."""
     from PIL import ImageFilter, Image
     import numpy as np
 
-    alpha = result.split()[-1]
+    alpha = Image.frombytes('L', size, data)
     a = np.array(alpha, dtype=np.float32)
 
     is_edge = (a > 5) & (a < 250)
@@ -55,9 +66,7 @@ def _refine_alpha(result):
     out[a >= 250] = 255
     out[a <= 5] = 0
 
-    refined = Image.fromarray(out.astype(np.uint8), mode='L')
-    result.putalpha(refined)
-    return result
+    return out.astype(np.uint8).tobytes()
 
 
 def remove_background(input_path, output_path=None, model=None,
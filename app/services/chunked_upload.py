@@ -0,0 +1,199 @@
+"""Resumable chunked uploads.
+
+A session is opened with the file name and total size, then chunks are
+appended at the current offset. Bytes are written straight to the final
+path in UPLOAD_FOLDER and fed to a running sha256 as they arrive, so
+completing an upload needs no second copy or re-read. The acknowledged
+offset only advances over bytes that are written and hashed; after a
+dropped connection the client asks for it and resumes from there.
+
+Session metadata is persisted in the store after every chunk, so uploads
+also resume across a server restart: the first request for an unknown
+session reloads it, truncates the file to the last recorded offset and
+re-hashes the bytes already received. Sessions idle longer than
+UPLOAD_SESSION_TTL_HOURS are dropped with their partial files.
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from app.config import MAX_CHUNKED_UPLOAD_SIZE, UPLOAD_SESSION_TTL_HOURS
+from app.services import storage, store
+from app.services.file_manager import register_reference_provider
+from app.services.state_store import ExpiringStore
+
+logger = logging.getLogger('telesticker.chunked')
+
+READ_BLOCK = 1024 * 1024
+
+
+class UploadConflict(Exception):
+    """Chunk offset doesn't match the session (or another append is running)."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    file_id: str
+    filename: str
+    path: str
+    size: int
+    session_id: str = ''
+    offset: int = 0
+    created_at: float = field(default_factory=time.time)
+    _hasher: object = field(default_factory=hashlib.sha256, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'file_id': self.file_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+        }
+
+    def to_record(self):
+        """Everything needed to resume, for the store."""
+        return dict(self.to_dict(), path=self.path, session_id=self.session_id, created_at=self.created_at)
+
+
+_sessions = ExpiringStore('uploads', ttl=UPLOAD_SESSION_TTL_HOURS * 3600, max_entries=10000)
+_restore_lock = threading.Lock()
+
+
+def create_upload(filename, size, session_id=''):
+    """Open a session and create the (empty) destination file."""
+    if size < 0 or size > MAX_CHUNKED_UPLOAD_SIZE:
+        raise ValueError(f'Upload size must be between 0 and {MAX_CHUNKED_UPLOAD_SIZE} bytes')
+    file_id = str(uuid.uuid4())
+    path = storage.upload_path(f'{file_id}_{filename}')
+    open(path, 'wb').close()
+    upload = UploadSession(
+        upload_id=uuid.uuid4().hex, file_id=file_id, filename=filename,
+        path=path, size=size, session_id=session_id,
+    )
+    store.save_upload(upload.upload_id, upload.to_record())
+    _sessions[upload.upload_id] = upload
+    return upload
+
+
+def get_upload(upload_id):
+    """The open session, reloading it from the store after a restart."""
+    upload = _sessions.get(upload_id)
+    if upload is not None:
+        return upload
+    with _restore_lock:
+        upload = _sessions.get(upload_id)
+        if upload is None:
+            upload = _restore(upload_id)
+        return upload
+
+
+def _restore(upload_id):
+    stored = store.get_upload(upload_id)
+    if stored is None:
+        return None
+    record, updated_at = stored
+    if time.time() - updated_at > UPLOAD_SESSION_TTL_HOURS * 3600 or not os.path.isfile(record['path']):
+        _discard(record)
+        return None
+
+    upload = UploadSession(
+        upload_id=record['upload_id'], file_id=record['file_id'], filename=record['filename'],
+        path=record['path'], size=record['size'], session_id=record['session_id'],
+        created_at=record['created_at'],
+    )
+    with open(upload.path, 'r+b') as f:
+        # Bytes past the recorded offset were never acknowledged
+        f.truncate(min(record['offset'], os.fstat(f.fileno()).st_size))
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            upload._hasher.update(block)
+            upload.offset += len(block)
+    _sessions[upload_id] = upload
+    logger.info(f'Resumed upload {upload_id} at {upload.offset}/{upload.size} bytes')
+    return upload
+
+
+def _discard(record):
+    store.delete_upload(record['upload_id'])
+    try:
+        os.remove(record['path'])
+    except OSError:
+        pass
+
+
+def append_chunk(upload, offset, stream):
+    """Write stream's bytes at offset. Returns the new acknowledged offset.
+
+    Raises UploadConflict if offset isn't the acknowledged one or another
+    chunk for this upload is still being written, and ValueError if the
+    chunk would run past the declared size.
+    """
+    if not upload._lock.acquire(blocking=False):
+        raise UploadConflict('Another chunk is in progress', upload.offset)
+    start = upload.offset
+    try:
+        if offset != upload.offset:
+            raise UploadConflict('Offset mismatch', upload.offset)
+        with open(upload.path, 'r+b') as f:
+            # Drop any unacknowledged tail left by an interrupted chunk
+            f.seek(upload.offset)
+            f.truncate()
+            for block in iter(lambda: stream.read(READ_BLOCK), b''):
+                if upload.offset + len(block) > upload.size:
+                    raise ValueError('Chunk exceeds declared upload size')
+                f.write(block)
+                upload._hasher.update(block)
+                upload.offset += len(block)
+        return upload.offset
+    finally:
+        try:
+            if upload.offset != start:
+                store.save_upload(upload.upload_id, upload.to_record())
+        finally:
+            upload._lock.release()
+
+
+def finish_upload(upload, sha256=None):
+    """Close a fully received upload. Returns its sha256 hex digest.
+
+    When sha256 is given it must match what was received; on a mismatch the
+    partial file is discarded.
+    """
+    with upload._lock:
+        if upload.offset != upload.size:
+            raise UploadConflict('Upload incomplete', upload.offset)
+        digest = upload._hasher.hexdigest()
+        if sha256 and sha256.lower() != digest:
+            abort_upload(upload)
+            raise ValueError('Checksum mismatch')
+        _sessions.pop(upload.upload_id)
+        store.delete_upload(upload.upload_id)
+        return digest
+
+
+def abort_upload(upload):
+    """Forget a session and delete its partial file."""
+    _sessions.pop(upload.upload_id)
+    _discard(upload.to_record())
+
+
+def _open_upload_files():
+    """Partial files of resumable sessions, in memory or persisted; sessions
+    idle past the TTL are dropped here."""
+    for record in store.pop_uploads_before(time.time() - UPLOAD_SESSION_TTL_HOURS * 3600):
+        _sessions.pop(record['upload_id'])
+        _discard(record)
+    return [upload.path for upload in _sessions.values()] + [r['path'] for r in store.get_uploads()]
+
+
+register_reference_provider(_open_upload_files)
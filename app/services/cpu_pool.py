@@ -0,0 +1,102 @@
+"""Pluggable executor for CPU-bound image work.
+
+In 'process' mode, calls run in a warm ProcessPoolExecutor sized to the core
+count so Pillow/numpy work isn't serialized behind the GIL. In 'thread' mode
+they run inline on the calling (job or request) thread. Only module-level
+functions with path/scalar arguments should be dispatched here.
+"""
+
+import sys
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.config import EXECUTOR_BACKEND, CPU_WORKERS
+
+logger = logging.getLogger('telesticker.cpu')
+
+_lock = threading.Lock()
+_pool = None
+_backend = EXECUTOR_BACKEND
+
+
+def _warm_worker():
+    """Pool initializer — pay the imports once per worker, not per task."""
+    import PIL.Image  # noqa: F401
+    import app.services.image_processor  # noqa: F401
+
+
+def _noop():
+    return None
+
+
+def is_worker_process():
+    """True inside a pool worker, including while spawn re-imports __main__
+    (web_app.py builds the app at import time). The parent registers
+    __mp_main__ too, as an alias of __main__, so check the module's name."""
+    if multiprocessing.parent_process() is not None:
+        return True
+    return getattr(sys.modules.get('__mp_main__'), '__name__', None) == '__mp_main__'
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(backend):
+    """Switch between 'process' and 'thread' execution."""
+    global _backend
+    if backend not in ('process', 'thread'):
+        raise ValueError(f'Unknown executor backend: {backend}')
+    if backend == 'thread':
+        shutdown()
+    _backend = backend
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn keeps workers free of the parent's threads and locks
+            _pool = ProcessPoolExecutor(
+                max_workers=CPU_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_worker,
+            )
+        return _pool
+
+
+def start():
+    """Create the pool and spin every worker up ahead of the first job."""
+    if _backend != 'process' or is_worker_process():
+        return
+    pool = _get_pool()
+    for _ in range(CPU_WORKERS):
+        pool.submit(_noop)
+    logger.info(f'CPU pool started with {CPU_WORKERS} worker processes')
+
+
+def run(fn, *args, **kwargs):
+    """Run fn on the configured backend and return its result."""
+    if _backend != 'process' or is_worker_process():
+        return fn(*args, **kwargs)
+    try:
+        return _get_pool().submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool:
+        logger.error('CPU pool broke, restarting it and running inline')
+        shutdown(wait=False)
+        return fn(*args, **kwargs)
+
+
+def shutdown(wait=True):
+    """Stop worker processes (registered with atexit)."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,88 @@
+"""Upload-side content deduplication.
+
+Uploads are hashed as they are written. When the content matches an
+existing sticker, the new upload's file (and thumbnail) become hard links to
+the existing ones, so the bytes are stored once, and the existing analysis
+is copied over instead of being recomputed. Each sticker still owns its own
+paths, so deleting one never breaks another. Sharing refreshes the mtime of
+the linked files, which moves content that was just uploaded again to the
+recent end of file_manager's LRU eviction order.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+from app.services import storage, store
+from app.services.video_processor import rebind_probe
+
+logger = logging.getLogger('telesticker.dedup')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def save_stream(stream, path):
+    """Write a file-like object to path. Returns the sha256 hex digest."""
+    h = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+            f.write(chunk)
+    return h.hexdigest()
+
+
+def _link(src, dst):
+    """Hard-link src to dst (copying where links aren't supported)."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    # The inode is shared, so this also keeps src from being evicted
+    os.utime(dst)
+
+
+def _find_source(sticker):
+    for existing in store.find_stickers_by_hash(sticker.content_hash):
+        if existing.file_id != sticker.file_id and os.path.isfile(existing.upload_path):
+            return existing
+    return None
+
+
+def share_existing(sticker):
+    """Point a freshly stored upload at an existing copy of the same content.
+
+    Returns True when the existing analysis was copied too (the sticker is
+    then ready), False when the caller still needs to analyze it.
+    """
+    source = _find_source(sticker)
+    if source is None:
+        return False
+    try:
+        _link(source.upload_path, sticker.upload_path)
+    except OSError as e:
+        logger.warning(f'Could not share {source.upload_path}: {e}')
+        return False
+    logger.info(f'Upload {sticker.file_id} duplicates {source.file_id}')
+
+    if source.status == 'analyzing':
+        return False
+
+    if source.thumbnail_url:
+        thumb_name = source.thumbnail_url.rsplit('/', 1)[-1]
+        new_name = thumb_name.replace(source.file_id, sticker.file_id, 1)
+        try:
+            _link(storage.upload_path(thumb_name, create=False), storage.upload_path(new_name))
+            sticker.thumbnail_url = f'/api/preview/{new_name}'
+        except OSError:
+            # Thumbnail already swept; let analysis regenerate it
+            return False
+
+    sticker.file_type = source.file_type
+    sticker.width = source.width
+    sticker.height = source.height
+    sticker.has_transparency = source.has_transparency
+    sticker.probe = rebind_probe(source.probe, sticker.upload_path)
+    sticker.status = 'uploaded'
+    return True
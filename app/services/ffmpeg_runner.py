@@ -0,0 +1,145 @@
+"""Process-wide governor for ffmpeg/ffprobe subprocesses.
+
+At most FFMPEG_MAX_PROCESSES run at once; callers beyond that wait in a
+priority queue so quick interactive work (probes, thumbnails) jumps ahead of
+queued batch encodes. Encoders get FFMPEG_THREADS threads each so the slots
+together cover the machine's cores without oversubscribing them.
+"""
+
+import time
+import heapq
+import logging
+import tempfile
+import itertools
+import threading
+import subprocess
+from contextlib import contextmanager
+from app.config import FFMPEG_MAX_PROCESSES, FFMPEG_THREADS
+
+logger = logging.getLogger('telesticker.ffmpeg')
+
+CANCEL_POLL_SECONDS = 0.25
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class FFmpegCancelled(Exception):
+    """Raised when a run_with_progress call is cancelled and its process killed."""
+
+
+_cond = threading.Condition()
+_waiting = []  # heap of (priority, seq) tickets
+_seq = itertools.count()
+_active = 0
+_completed = 0
+
+
+@contextmanager
+def slot(priority=PRIORITY_BATCH, cancel=None):
+    """Hold one ffmpeg slot for the duration of the block.
+
+    cancel() is polled every CANCEL_POLL_SECONDS while queued; when it returns
+    True the ticket is withdrawn and FFmpegCancelled raised.
+    """
+    global _active, _completed
+    ticket = (priority, next(_seq))
+    with _cond:
+        heapq.heappush(_waiting, ticket)
+        while _active >= FFMPEG_MAX_PROCESSES or _waiting[0] != ticket:
+            if cancel and cancel():
+                _waiting.remove(ticket)
+                heapq.heapify(_waiting)
+                # The head of the queue may have changed
+                _cond.notify_all()
+                raise FFmpegCancelled('cancelled while queued')
+            _cond.wait(CANCEL_POLL_SECONDS if cancel else None)
+        heapq.heappop(_waiting)
+        _active += 1
+        # Another slot may still be free for the next ticket in line
+        _cond.notify_all()
+    try:
+        yield
+    finally:
+        with _cond:
+            _active -= 1
+            _completed += 1
+            _cond.notify_all()
+
+
+def run(cmd, priority=PRIORITY_BATCH, **kwargs):
+    """subprocess.run under the governor."""
+    with slot(priority):
+        return subprocess.run(cmd, **kwargs)
+
+
+def run_with_progress(cmd, on_progress=None, cancel=None, timeout=None, priority=PRIORITY_BATCH):
+    """Run an ffmpeg command under the governor with -progress output.
+
+    on_progress(dict) gets each progress block (frame, out_time_us, ...).
+    cancel() is polled every CANCEL_POLL_SECONDS, from the moment the call
+    queues for a slot; when it returns True the process is killed (or never
+    started) and FFmpegCancelled raised. Raises CalledProcessError on
+    a non-zero exit and TimeoutExpired after timeout seconds of run time.
+    """
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1', *cmd[1:]]
+    with slot(priority, cancel), tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr,
+                                stdin=subprocess.DEVNULL, text=True)
+        reader = threading.Thread(target=_read_progress, args=(proc.stdout, on_progress), daemon=True)
+        reader.start()
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            while True:
+                try:
+                    proc.wait(timeout=CANCEL_POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if cancel and cancel():
+                    raise FFmpegCancelled(cmd[0])
+                if deadline and time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            reader.join(timeout=1)
+
+        if proc.returncode:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr.read()[-2000:])
+        return proc.returncode
+
+
+def _read_progress(stream, on_progress):
+    block = {}
+    for line in stream:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        block[key] = value
+        if key == 'progress':
+            if on_progress:
+                try:
+                    on_progress(block)
+                except Exception as e:
+                    logger.warning(f'Progress callback failed: {e}')
+            block = {}
+
+
+def encoder_threads():
+    """Per-encode threading flags for libvpx-vp9."""
+    return ['-threads', str(FFMPEG_THREADS), '-row-mt', '1']
+
+
+def get_stats():
+    with _cond:
+        return {
+            'active': _active,
+            'queued': len(_waiting),
+            'completed': _completed,
+            'max_processes': FFMPEG_MAX_PROCESSES,
+            'threads_per_encode': FFMPEG_THREADS,
+        }
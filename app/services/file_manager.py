@@ -1,13 +1,100 @@
-"""File lifecycle management — temp file cleanup scheduler."""
+"""File lifecycle management — incremental, reference-aware storage eviction.
+
+A background thread keeps an index of the (sharded) upload and output
+folders, built with os.scandir a batch of entries per tick rather than in one
+full sweep.
+Each tick evicts least-recently-modified files that are past
+FILE_MAX_AGE_HOURS or beyond the STORAGE_QUOTA_MB byte quota, up to
+CLEANUP_EVICT_BATCH files. Reuse refreshes mtime (output cache hits,
+deduplicated uploads), so mtime order is LRU order.
+
+Files are never evicted while referenced: reference providers registered by
+other services report paths of live records (stickers younger than
+FILE_MAX_AGE_HOURS or being worked on, stickers in packs, uploads in
+progress), and work in flight pins the paths it is using (running jobs,
+analyses, Telegram publishes). Provider results are cached for
+CLEANUP_REFERENCE_TTL_SECONDS or until invalidate_references() (called when a
+sticker is created or a pack edit may reference old files), and the
+oldest-first order is only re-sorted when the index changes, so a referenced
+file stuck at the head of the order costs a set lookup per tick rather than a
+re-query. Deduplicated uploads are hard links to one inode; bytes are
+counted, and reported as reclaimed, once per inode.
+"""
 
 import os
 import time
 import logging
 import threading
-from app.config import UPLOAD_FOLDER, OUTPUT_FOLDER, CLEANUP_INTERVAL_HOURS, FILE_MAX_AGE_HOURS
+from collections import Counter
+from contextlib import contextmanager
+from app.config import (
+    UPLOAD_FOLDER, OUTPUT_FOLDER, FILE_MAX_AGE_HOURS, STORAGE_QUOTA_MB,
+    CLEANUP_TICK_SECONDS, CLEANUP_SCAN_BATCH, CLEANUP_EVICT_BATCH, CLEANUP_REFERENCE_TTL_SECONDS
+)
+from app.services import output_cache, storage
 
 logger = logging.getLogger('telesticker.files')
 
+_cleanup_hooks = []
+_reference_providers = []
+
+_lock = threading.Lock()  # serializes sweeps
+_pin_lock = threading.Lock()
+_pins = Counter()
+_wake = threading.Event()
+
+_index = {}  # path -> (size, mtime, (dev, ino))
+_order = None  # indexed paths, oldest mtime first; None when the index changed
+_scan = None  # in-progress scandir pass
+_seen = set()  # paths seen during the current pass
+_references = None  # cached provider results
+_references_at = 0.0
+
+_stats = {
+    'evicted_files': 0,
+    'reclaimed_bytes': 0,
+    'skipped_referenced': 0,
+    'scan_passes': 0,
+    'last_sweep_seconds': 0.0,
+    'last_sweep_at': 0.0,
+}
+
+
+def register_cleanup_hook(fn):
+    """Call fn(removed_paths) after every eviction pass, so in-memory records
+    referencing deleted files can be dropped (and stores pruned)."""
+    _cleanup_hooks.append(fn)
+
+
+def register_reference_provider(fn):
+    """fn() returns paths that must not be evicted; asked once per pass that
+    has eviction candidates."""
+    _reference_providers.append(fn)
+
+
+def pin(*paths):
+    """Protect paths from eviction until a matching unpin()."""
+    with _pin_lock:
+        _pins.update(os.path.abspath(p) for p in paths if p)
+
+
+def unpin(*paths):
+    with _pin_lock:
+        _pins.subtract(os.path.abspath(p) for p in paths if p)
+        for p in [p for p, n in _pins.items() if n <= 0]:
+            del _pins[p]
+
+
+@contextmanager
+def pinned(paths):
+    """Protect paths from eviction for the duration of the block."""
+    paths = [p for p in paths if p]
+    pin(*paths)
+    try:
+        yield
+    finally:
+        unpin(*paths)
+
 
 def ensure_dirs():
     """Create required directories if they don't exist."""
@@ -15,35 +102,192 @@ def ensure_dirs():
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 
-def cleanup_old_files():
-    """Delete files older than FILE_MAX_AGE_HOURS from uploads and output."""
-    max_age = FILE_MAX_AGE_HOURS * 3600
-    now = time.time()
-    count = 0
+def invalidate_references():
+    """Ask providers again before the next eviction (e.g. after a pack edit
+    made an old file referenced)."""
+    global _references
+    _references = None
+
+
+def request_sweep():
+    """Run the next eviction tick now (e.g. after a burst of uploads)."""
+    _wake.set()
+
+
+def _iter_entries():
+    for root in storage.ROOTS:
+        yield from storage.iter_files(root)
+
+
+def _record(path, st):
+    global _order
+    entry = (st.st_size, st.st_mtime, (st.st_dev, st.st_ino))
+    if _index.get(path) != entry:
+        _index[path] = entry
+        _order = None
+
 
-    for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
-        if not os.path.isdir(folder):
+def _scan_step(limit):
+    """Index up to limit directory entries. Returns True when a pass finished."""
+    global _scan, _seen, _order
+    if _scan is None:
+        _scan = _iter_entries()
+        _seen = set()
+    for _ in range(limit):
+        entry = next(_scan, None)
+        if entry is None:
+            # Files deleted behind our back drop out at the end of each pass
+            gone = set(_index) - _seen
+            for path in gone:
+                del _index[path]
+            if gone:
+                _order = None
+            _scan = None
+            _stats['scan_passes'] += 1
+            return True
+        try:
+            path = os.path.abspath(entry.path)
+            _record(path, entry.stat(follow_symlinks=False))
+            _seen.add(path)
+        except OSError:
             continue
-        for fname in os.listdir(folder):
-            fpath = os.path.join(folder, fname)
+    return False
+
+
+def _used_bytes():
+    inodes = {}
+    for size, _, inode in _index.values():
+        inodes[inode] = size
+    return sum(inodes.values())
+
+
+def _provider_references():
+    """Paths reported by the reference providers, cached between ticks."""
+    global _references, _references_at
+    now = time.monotonic()
+    if _references is None or now - _references_at >= CLEANUP_REFERENCE_TTL_SECONDS:
+        referenced = set()
+        for provider in _reference_providers:
             try:
-                if os.path.isfile(fpath) and (now - os.path.getmtime(fpath)) > max_age:
-                    os.remove(fpath)
-                    count += 1
+                referenced.update(os.path.abspath(p) for p in provider() if p)
             except Exception as e:
-                logger.warning(f'Failed to remove {fpath}: {e}')
+                logger.warning(f'Reference provider failed: {e}')
+        _references, _references_at = referenced, now
+    return _references
+
+
+def _oldest_first():
+    global _order
+    if _order is None:
+        _order = sorted(_index, key=lambda path: _index[path][1])
+    return _order
 
-    if count:
-        logger.info(f'Cleaned up {count} old files')
+
+def _evict(limit):
+    """Evict up to limit expired or over-quota files, oldest first."""
+    global _order
+    cutoff = time.time() - FILE_MAX_AGE_HOURS * 3600
+    quota = STORAGE_QUOTA_MB * 1024 * 1024
+    used = _used_bytes()
+    order = _oldest_first()
+    if not order or (_index[order[0]][1] >= cutoff and used <= quota):
+        return set()
+
+    referenced = _provider_references()
+    with _pin_lock:
+        pins = set(_pins)
+    removed = set()
+    removed_from_index = False
+    for path in order:
+        entry = _index.get(path)
+        if entry is None:
+            continue
+        size, mtime, _ = entry
+        if len(removed) >= limit or (mtime >= cutoff and used <= quota):
+            break
+        if path in referenced or path in pins:
+            _stats['skipped_referenced'] += 1
+            continue
+        try:
+            st = os.stat(path)
+            if st.st_mtime != mtime:
+                # Touched since indexed; reconsider it on a later tick
+                _record(path, st)
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            _index.pop(path, None)
+            removed_from_index = True
+            continue
+        except OSError as e:
+            logger.warning(f'Failed to remove {path}: {e}')
+            continue
+        del _index[path]
+        output_cache.discard_path(path)
+        removed.add(path)
+        _stats['evicted_files'] += 1
+        # Bytes are only freed when the last link goes
+        if st.st_nlink <= 1:
+            used -= size
+            _stats['reclaimed_bytes'] += size
+
+    if (removed or removed_from_index) and _order is order:
+        _order = [path for path in order if path in _index]
+    return removed
+
+
+def sweep_step(scan_batch=CLEANUP_SCAN_BATCH, evict_batch=CLEANUP_EVICT_BATCH):
+    """One incremental tick: index a batch of entries, then evict a batch."""
+    with _lock:
+        started = time.monotonic()
+        if scan_batch:
+            _scan_step(scan_batch)
+        removed = _evict(evict_batch)
+        _stats['last_sweep_seconds'] = round(time.monotonic() - started, 4)
+        _stats['last_sweep_at'] = time.time()
+
+    if removed:
+        logger.info(f'Evicted {len(removed)} files')
+    for hook in _cleanup_hooks:
+        try:
+            hook(removed)
+        except Exception as e:
+            logger.warning(f'Cleanup hook failed: {e}')
+    return removed
+
+
+def cleanup_old_files():
+    """Full pass: re-index both folders and evict everything eligible."""
+    global _scan
+    with _lock:
+        _scan = None
+        while not _scan_step(CLEANUP_SCAN_BATCH):
+            pass
+    return sweep_step(scan_batch=0, evict_batch=len(_index))
+
+
+def get_stats():
+    with _lock:
+        return dict(
+            _stats,
+            files=len(_index),
+            bytes=_used_bytes(),
+            quota_bytes=STORAGE_QUOTA_MB * 1024 * 1024,
+            pinned=len(_pins),
+        )
 
 
 def start_cleanup_scheduler():
-    """Start a background thread that cleans old files periodically."""
+    """Start the background eviction thread."""
     def _loop():
         while True:
-            time.sleep(CLEANUP_INTERVAL_HOURS * 3600)
-            cleanup_old_files()
+            _wake.wait(CLEANUP_TICK_SECONDS)
+            _wake.clear()
+            try:
+                sweep_step()
+            except Exception as e:
+                logger.error(f'Eviction tick failed: {e}')
 
     t = threading.Thread(target=_loop, daemon=True)
     t.start()
-    logger.info('File cleanup scheduler started')
+    logger.info('File eviction scheduler started')
@@ -4,30 +4,19 @@ import io
 import os
 import logging
 from PIL import Image
-from app.config import MAX_IMAGE_SIZE, MAX_IMAGE_SIZE_KB, ICON_SIZE, CUSTOM_EMOJI_SIZE
+from app.config import MAX_IMAGE_SIZE, MAX_IMAGE_SIZE_KB, ICON_SIZE, MAX_ICON_SIZE_KB, CUSTOM_EMOJI_SIZE
+from app.services import cpu_pool
+from app.utils import atomic_output
 
 logger = logging.getLogger('telesticker.image')
 
 
-def detect_transparency(filepath):
-    """Check if an image has transparency."""
-    try:
-        with Image.open(filepath) as img:
-            if img.mode == 'RGBA':
-                extrema = img.getextrema()
-                if len(extrema) >= 4 and extrema[3][0] < 255:
-                    return True
-            elif img.mode == 'PA':
-                return True
-            elif img.info.get('transparency') is not None:
-                return True
-        return False
-    except Exception:
-        return False
-
-
 def generate_thumbnail(filepath, thumb_path, size=(200, 200)):
     """Generate a thumbnail for preview."""
+    return cpu_pool.run(_generate_thumbnail, filepath, thumb_path, size)
+
+
+def _generate_thumbnail(filepath, thumb_path, size):
     try:
         with Image.open(filepath) as img:
             img.thumbnail(size, Image.LANCZOS)
@@ -41,18 +30,106 @@ def generate_thumbnail(filepath, thumb_path, size=(200, 200)):
         return False
 
 
-def estimate_output_size(img, fmt='webp', quality=95):
-    """Estimate output file size without writing to disk."""
-    buf = io.BytesIO()
-    if fmt == 'webp':
+def analyze_image(filepath, thumb_path=None, thumb_size=(200, 200)):
+    """Probe an upload in one decode: frames, size, mode, format, alpha, thumbnail.
+
+    JPEGs are draft-decoded at reduced resolution since only the thumbnail
+    needs pixels. Returns a dict, or None if the file can't be read.
+    """
+    return cpu_pool.run(_analyze_image, filepath, thumb_path, thumb_size)
+
+
+def _analyze_image(filepath, thumb_path, thumb_size):
+    try:
+        with Image.open(filepath) as img:
+            info = {
+                'width': img.width,
+                'height': img.height,
+                'mode': img.mode,
+                'format': img.format,
+                'frames': getattr(img, 'n_frames', 1),
+                'has_transparency': False,
+                'thumbnail': None,
+            }
+            if info['frames'] > 1:
+                img.seek(0)
+
+            if img.format == 'JPEG':
+                img.draft('RGB', thumb_size)
+            img.load()
+
+            if img.mode in ('RGBA', 'LA'):
+                info['has_transparency'] = img.getchannel('A').getextrema()[0] < 255
+            elif img.mode == 'PA' or img.info.get('transparency') is not None:
+                info['has_transparency'] = True
+
+            if thumb_path:
+                try:
+                    thumb = img.copy()
+                    thumb.thumbnail(thumb_size, Image.LANCZOS)
+                    if thumb.mode == 'RGBA':
+                        thumb.save(thumb_path, 'PNG')
+                    else:
+                        thumb.save(thumb_path, 'WEBP', quality=80)
+                    info['thumbnail'] = thumb_path
+                except Exception as e:
+                    logger.error(f'Thumbnail generation failed: {e}')
+            return info
+    except Exception as e:
+        logger.error(f'Image analysis failed: {e}')
+        return None
+
+
+def encode_webp_within_budget(img, max_bytes, min_quality=10, max_quality=95):
+    """Bisect WebP quality to fit max_bytes, encoding each candidate once.
+
+    Returns (data, quality, encodes). The highest in-budget quality wins; if
+    nothing fits, the min_quality encode is returned as a last resort.
+    """
+    encodes = 0
+
+    def encode(quality):
+        nonlocal encodes
+        encodes += 1
+        buf = io.BytesIO()
         img.save(buf, 'WEBP', quality=quality)
-    else:
-        img.save(buf, 'PNG')
-    return buf.tell()
+        return buf.getvalue()
+
+    # Most stickers fit at full quality — try that first
+    data = encode(max_quality)
+    if len(data) <= max_bytes:
+        return data, max_quality, encodes
+
+    best = None
+    best_quality = quality = max_quality
+    lo, hi = min_quality, max_quality - 1
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        data = encode(quality)
+        if len(data) <= max_bytes:
+            best, best_quality = data, quality
+            lo = quality + 1
+        else:
+            hi = quality - 1
+
+    if best is None:
+        # Nothing fits; bisection always ends on min_quality
+        return data, quality, encodes
+    return best, best_quality, encodes
+
 
+def resize_image(input_path, output_path, output_format='webp', is_icon=False, is_emoji=False, stats=None):
+    """Resize image to Telegram sticker specs within the size budget.
 
-def resize_image(input_path, output_path, output_format='webp', is_icon=False, is_emoji=False):
-    """Resize image to Telegram sticker specs with quality iteration."""
+    If stats is a dict it receives 'encodes' and 'quality' for the file.
+    """
+    ok, result_stats = cpu_pool.run(_resize_image, input_path, output_path, output_format, is_icon, is_emoji)
+    if stats is not None:
+        stats.update(result_stats)
+    return ok
+
+
+def _resize_image(input_path, output_path, output_format, is_icon, is_emoji):
     try:
         img = Image.open(input_path)
 
@@ -83,37 +160,19 @@ def resize_image(input_path, output_path, output_format='webp', is_icon=False, i
 
         max_kb = MAX_IMAGE_SIZE_KB
         if is_icon:
-            max_kb = 32
-
-        if output_format == 'webp':
-            # Iterative quality reduction to meet size limit
-            quality = 95
-            for _ in range(10):
-                size = estimate_output_size(img, 'webp', quality)
-                if size <= max_kb * 1024:
-                    img.save(output_path, 'WEBP', quality=quality)
-                    return True
-                quality = max(10, quality - 10)
-            # Last resort
-            img.save(output_path, 'WEBP', quality=quality)
-        else:
-            img.save(output_path, 'PNG')
+            max_kb = MAX_ICON_SIZE_KB
+
+        with atomic_output(output_path) as tmp:
+            if output_format == 'webp':
+                data, quality, encodes = encode_webp_within_budget(img, max_kb * 1024)
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                logger.debug(f'{os.path.basename(input_path)}: webp q={quality} in {encodes} encodes')
+            else:
+                img.save(tmp, 'PNG')
+                quality, encodes = None, 1
 
-        return True
+        return True, {'encodes': encodes, 'quality': quality}
     except Exception as e:
         logger.error(f'Image resize failed: {e}')
-        return False
-
-
-def get_image_info(filepath):
-    """Get image dimensions and basic info."""
-    try:
-        with Image.open(filepath) as img:
-            return {
-                'width': img.width,
-                'height': img.height,
-                'mode': img.mode,
-                'format': img.format,
-            }
-    except Exception:
-        return None
+        return False, {}
@@ -5,39 +5,61 @@ import time
 import uuid
 import logging
 import zipfile
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from app.config import MAX_WORKERS, OUTPUT_FOLDER
+from app.config import MAX_WORKERS, JOB_MAX_CONCURRENCY, PROGRESS_EMIT_INTERVAL
 from app.models.job import Job
+from app.services import output_cache, storage, store, file_manager
 from app.services.image_processor import resize_image
 from app.services.video_processor import convert_video, convert_gif_to_video
-from app.utils import is_animated_gif
+from app.utils import processing_type
 
 logger = logging.getLogger('telesticker.jobs')
 
 # Global state
 _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-_jobs = {}
 
-
-def get_job(job_id):
-    return _jobs.get(job_id)
+STORED_EXTENSIONS = {'webp', 'webm', 'png', 'gif', 'jpg', 'jpeg'}
 
 
 def cancel_job(job_id):
-    job = _jobs.get(job_id)
+    job = store.get_job(job_id)
     if job:
         job.cancelled = True
         return True
     return False
 
 
-def submit_job(files_config, socketio, sid=None):
+def _zip_compression(name):
+    """Store already-compressed outputs; deflating WebP/WebM/PNG only burns CPU."""
+    ext = name.rsplit('.', 1)[-1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def submit_job(files_config, socketio, sid=None, session_id=''):
     """Submit a processing job. files_config is a list of dicts with:
-    - file_id, upload_path, file_type, output_format, mode
+    - file_id, upload_path, file_type, output_format, mode, and optionally
+      probe (a stored probe_video result) and content_hash (sha256 of the upload)
+
+    Each file runs as its own task on the shared executor, with at most
+    JOB_MAX_CONCURRENCY of a job's files in flight at once.
     """
     job_id = str(uuid.uuid4())
-    job = Job(job_id=job_id, total_files=len(files_config))
-    _jobs[job_id] = job
+    job = Job(job_id=job_id, total_files=len(files_config), session_id=session_id)
+    store.save_job(job)
+
+    lock = threading.Lock()
+    pending = iter(enumerate(files_config))
+    results = [None] * len(files_config)
+    in_flight = 0
+    file_fractions = {}  # file index -> fraction done, for in-flight encodes
+    zip_name = f'telegram_stickers_{job_id}.zip'
+    zip_path = storage.output_path(zip_name)
+    zip_lock = threading.Lock()
+    zf = None
+    # Inputs and outputs stay pinned against eviction until the job finishes
+    pinned = [zip_path] + [fc['upload_path'] for fc in files_config]
+    file_manager.pin(*pinned)
 
     def emit(event, data):
         if sid:
@@ -45,102 +67,234 @@ def submit_job(files_config, socketio, sid=None):
         else:
             socketio.emit(event, data)
 
-    def process():
-        job.status = 'processing'
-        emit('processing_update', {
-            'job_id': job_id,
-            'status': 'processing',
-            'message': f'Starting processing of {job.total_files} files...',
-            'progress': 0
-        })
+    def add_to_zip(path, name):
+        """Append a finished output to the job's ZIP as it completes."""
+        nonlocal zf
+        with zip_lock:
+            if zf is None:
+                zf = zipfile.ZipFile(zip_path, 'w')
+            zf.write(path, name, compress_type=_zip_compression(name))
 
-        for i, fc in enumerate(files_config):
-            if job.cancelled:
-                job.status = 'cancelled'
-                emit('processing_update', {
-                    'job_id': job_id, 'status': 'cancelled',
-                    'message': 'Processing cancelled', 'progress': job.progress
-                })
-                return
+    def close_zip(keep):
+        with zip_lock:
+            if zf is not None:
+                zf.close()
+                if not keep:
+                    os.remove(zip_path)
+
+    def mark_sticker(file_id, status, processed_path=None):
+        sticker = store.get_sticker(file_id)
+        if sticker is None:
+            return
+        sticker.status = status
+        if processed_path:
+            sticker.processed_path = processed_path
+        store.save_sticker(sticker)
 
-            file_id = fc['file_id']
-            input_path = fc['upload_path']
-            file_type = fc['file_type']
-            output_format = fc.get('output_format', 'webp')
-            mode = fc.get('mode', 'sticker')
-            is_icon = mode == 'icon'
-            is_emoji = mode == 'emoji'
-            original_name = os.path.basename(input_path)
+    def overall_progress():
+        """Job progress counting partial work of in-flight files. Caller must hold lock."""
+        done = job.processed_files + sum(file_fractions.values())
+        return max(job.progress, int(done / job.total_files * 100))
 
+    def encode_progress(i, file_id):
+        """ffmpeg progress callback emitting at most every PROGRESS_EMIT_INTERVAL seconds."""
+        last_emit = 0.0
+
+        def report(p):
+            nonlocal last_emit
+            with lock:
+                file_fractions[i] = p['fraction']
+                progress = overall_progress()
+            now = time.monotonic()
+            if now - last_emit < PROGRESS_EMIT_INTERVAL:
+                return
+            last_emit = now
             emit('processing_update', {
                 'job_id': job_id,
                 'file_id': file_id,
                 'status': 'processing',
-                'message': f'Processing {original_name}...',
-                'progress': int((i / job.total_files) * 100)
+                'stage': p['stage'],
+                'attempt': p['attempt'],
+                'frame': p['frame'],
+                'out_time': p['out_time'],
+                'file_progress': int(p['fraction'] * 100),
+                'progress': progress,
             })
+        return report
+
+    def process_file(i, fc):
+        file_id = fc['file_id']
+        input_path = fc['upload_path']
+        file_type = fc['file_type']
+        output_format = fc.get('output_format', 'webp')
+        mode = fc.get('mode', 'sticker')
+        is_icon = mode == 'icon'
+        is_emoji = mode == 'emoji'
+        original_name = os.path.basename(input_path)
+
+        emit('processing_update', {
+            'job_id': job_id,
+            'file_id': file_id,
+            'status': 'processing',
+            'message': f'Processing {original_name}...',
+            'progress': job.progress
+        })
+
+        try:
+            success = False
+            stats = {}
+
+            file_type = processing_type(file_type, input_path)
+            if file_type in ('animated_gif', 'video'):
+                ext = 'webm'
+            else:
+                ext = output_format if output_format in ('webp', 'png') else 'webp'
+            # The job id keeps names unique across jobs; outputs may be cache links
+            out_name = f'sticker_{i+1}_{job_id}.{ext}'
+            out_path = storage.output_path(out_name)
+            file_manager.pin(out_path)
+            with lock:
+                pinned.append(out_path)
+
+            content_hash = fc.get('content_hash') or output_cache.hash_file(input_path)
+            cache_key = output_cache.make_key(content_hash, file_type, output_format, mode)
+            cached = output_cache.lookup(cache_key, out_path)
+
+            if cached:
+                success = True
+                stats['encodes'] = 0
+            elif file_type in ('animated_gif', 'video'):
+                convert = convert_gif_to_video if file_type == 'animated_gif' else convert_video
+                success = convert(input_path, out_path, is_icon=is_icon, stats=stats, probe=fc.get('probe'),
+                                  progress_callback=encode_progress(i, file_id),
+                                  cancel=lambda: job.cancelled)
+            elif file_type == 'image':
+                success = resize_image(input_path, out_path, output_format, is_icon=is_icon, is_emoji=is_emoji,
+                                       stats=stats)
+
+            if success and not cached:
+                output_cache.store(cache_key, out_path)
 
-            try:
-                ts = int(time.time())
-                success = False
-
-                if file_type == 'animated_gif' or (file_type == 'image' and is_animated_gif(input_path)):
-                    out_name = f'sticker_{i+1}_{ts}.webm'
-                    out_path = os.path.join(OUTPUT_FOLDER, out_name)
-                    success = convert_gif_to_video(input_path, out_path, is_icon=is_icon)
-                elif file_type == 'video':
-                    out_name = f'sticker_{i+1}_{ts}.webm'
-                    out_path = os.path.join(OUTPUT_FOLDER, out_name)
-                    success = convert_video(input_path, out_path, is_icon=is_icon)
-                elif file_type == 'image':
-                    ext = output_format if output_format in ('webp', 'png') else 'webp'
-                    out_name = f'sticker_{i+1}_{ts}.{ext}'
-                    out_path = os.path.join(OUTPUT_FOLDER, out_name)
-                    success = resize_image(input_path, out_path, output_format, is_icon=is_icon, is_emoji=is_emoji)
-
-                if success:
-                    job.file_results.append({
-                        'file_id': file_id,
-                        'original': original_name,
-                        'processed': out_name,
-                        'path': out_path,
-                        'size': os.path.getsize(out_path),
-                    })
-                    emit('file_processed', {
-                        'job_id': job_id,
-                        'file_id': file_id,
-                        'status': 'success',
-                        'processed_name': out_name,
-                        'size': os.path.getsize(out_path),
-                    })
-                else:
-                    emit('file_processed', {
-                        'job_id': job_id,
-                        'file_id': file_id,
-                        'status': 'error',
-                        'message': f'Failed to process {original_name}',
-                    })
-
-            except Exception as e:
-                logger.error(f'Error processing {original_name}: {e}')
+            if success:
+                result = {
+                    'file_id': file_id,
+                    'original': original_name,
+                    'processed': out_name,
+                    'path': out_path,
+                    'size': os.path.getsize(out_path),
+                    'encodes': stats.get('encodes'),
+                    'attempts': stats.get('attempts'),
+                    'cached': cached,
+                }
+                with lock:
+                    results[i] = result
+                    job.file_results.append(result)
+                add_to_zip(out_path, f'sticker_{i+1}.{ext}')
+                mark_sticker(file_id, 'processed', processed_path=out_path)
+                emit('file_processed', {
+                    'job_id': job_id,
+                    'file_id': file_id,
+                    'status': 'success',
+                    'processed_name': out_name,
+                    'size': os.path.getsize(out_path),
+                })
+            elif job.cancelled:
+                mark_sticker(file_id, 'uploaded')
+                emit('file_processed', {
+                    'job_id': job_id,
+                    'file_id': file_id,
+                    'status': 'cancelled',
+                    'message': f'Cancelled {original_name}',
+                })
+            else:
+                mark_sticker(file_id, 'error')
                 emit('file_processed', {
                     'job_id': job_id,
                     'file_id': file_id,
                     'status': 'error',
-                    'message': str(e),
+                    'message': f'Failed to process {original_name}',
                 })
 
-            job.processed_files = i + 1
+        except Exception as e:
+            logger.error(f'Error processing {original_name}: {e}')
+            mark_sticker(file_id, 'error')
+            emit('file_processed', {
+                'job_id': job_id,
+                'file_id': file_id,
+                'status': 'error',
+                'message': str(e),
+            })
+
+    def run_file(i, fc):
+        with lock:
+            starting = job.status == 'pending'
+            if starting:
+                job.status = 'processing'
+        if starting:
+            store.save_job(job)
+            emit('processing_update', {
+                'job_id': job_id,
+                'status': 'processing',
+                'message': f'Starting processing of {job.total_files} files...',
+                'progress': 0
+            })
+        try:
+            if job.cancelled:
+                # Queued behind the executor when the job was cancelled
+                mark_sticker(fc['file_id'], 'uploaded')
+            else:
+                process_file(i, fc)
+        finally:
+            file_done(i)
+
+    def dispatch():
+        """Fill this job's free slots. Caller must hold lock."""
+        nonlocal in_flight
+        while in_flight < JOB_MAX_CONCURRENCY and not job.cancelled:
+            nxt = next(pending, None)
+            if nxt is None:
+                break
+            in_flight += 1
+            _executor.submit(run_file, *nxt)
+
+    def file_done(i):
+        nonlocal in_flight
+        with lock:
+            job.processed_files += 1
+            file_fractions.pop(i, None)
+            in_flight -= 1
+            dispatch()
+            finished = in_flight == 0
+        if finished:
+            finish()
+
+    def finish():
+        file_manager.unpin(*pinned)
+        # Files never dispatched (the job was cancelled) go back to 'uploaded'
+        with lock:
+            undispatched = [fc for _, fc in pending]
+        for fc in undispatched:
+            mark_sticker(fc['file_id'], 'uploaded')
+        if job.cancelled and None in results:
+            close_zip(keep=False)
+            job.status = 'cancelled'
+            store.save_job(job)
+            emit('processing_update', {
+                'job_id': job_id, 'status': 'cancelled',
+                'message': 'Processing cancelled', 'progress': job.progress
+            })
+            return
+
+        # Keep results in submission order
+        job.file_results = [r for r in results if r is not None]
+        logger.info(f'Job {job_id} done, output cache: {output_cache.get_stats()}')
 
-        # Create ZIP
+        # Entries were appended as files finished; just finalize the directory
+        close_zip(keep=bool(job.file_results))
         if job.file_results:
-            zip_name = f'telegram_stickers_{job_id}.zip'
-            zip_path = os.path.join(OUTPUT_FOLDER, zip_name)
-            with zipfile.ZipFile(zip_path, 'w') as zf:
-                for fr in job.file_results:
-                    zf.write(fr['path'], fr['processed'])
             job.zip_path = zip_path
             job.status = 'complete'
+            store.save_job(job)
 
             emit('processing_complete', {
                 'job_id': job_id,
@@ -153,6 +307,7 @@ def submit_job(files_config, socketio, sid=None):
         else:
             job.status = 'error'
             job.error_message = 'No files were successfully processed.'
+            store.save_job(job)
             emit('processing_complete', {
                 'job_id': job_id,
                 'status': 'error',
@@ -160,5 +315,9 @@ def submit_job(files_config, socketio, sid=None):
                 'progress': 100,
             })
 
-    _executor.submit(process)
+    with lock:
+        dispatch()
+        finished = in_flight == 0
+    if finished:
+        finish()
     return job_id
@@ -0,0 +1,138 @@
+"""Content-addressed cache of processed sticker outputs.
+
+Entries map (input content hash, processing params) to an output file that
+already exists in OUTPUT_FOLDER. A hit hard-links that file to the new output
+path instead of re-encoding. The cache never deletes files itself: evicted
+entries are simply forgotten and reclaimed later by file_manager's eviction,
+while hits refresh the cached file's mtime so live entries stay at the recent
+end of its LRU order.
+
+Cached files may be hard-linked under several output names, so outputs are
+only ever replaced by rename (utils.atomic_output), never rewritten in place.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from app.config import (
+    MAX_IMAGE_SIZE, MAX_IMAGE_SIZE_KB, MAX_VIDEO_SIZE_KB, MAX_VIDEO_DURATION,
+    ICON_SIZE, MAX_ICON_SIZE_KB, CUSTOM_EMOJI_SIZE, VIDEO_FPS,
+    ENCODER_VERSION, OUTPUT_CACHE_MAX_MB, OUTPUT_CACHE_MAX_ENTRIES
+)
+from app.utils import atomic_output
+
+logger = logging.getLogger('telesticker.cache')
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> {'path': str, 'size': int}
+_by_path = {}  # path -> key
+_bytes = 0
+_hits = 0
+_misses = 0
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(content_hash, file_type, output_format, mode):
+    """Build a cache key from the input hash and everything that affects the output."""
+    if file_type == 'image':
+        fmt = output_format if output_format in ('webp', 'png') else 'webp'
+    else:
+        fmt = 'webm'
+    limits = (
+        MAX_IMAGE_SIZE, MAX_IMAGE_SIZE_KB, MAX_VIDEO_SIZE_KB, MAX_VIDEO_DURATION,
+        ICON_SIZE, MAX_ICON_SIZE_KB, CUSTOM_EMOJI_SIZE, VIDEO_FPS,
+    )
+    params = f'v{ENCODER_VERSION}|{file_type}|{fmt}|{mode}|' + ','.join(map(str, limits))
+    return f'{content_hash}:{hashlib.sha1(params.encode()).hexdigest()}'
+
+
+def lookup(key, out_path):
+    """Materialize a cached output at out_path. Returns True on a hit."""
+    global _hits, _misses
+    with _lock:
+        entry = _entries.get(key)
+        if entry and not os.path.isfile(entry['path']):
+            _drop(key)
+            entry = None
+        if entry is None:
+            _misses += 1
+            return False
+        _entries.move_to_end(key)
+        _hits += 1
+        cached_path = entry['path']
+
+    try:
+        os.utime(cached_path)
+        if os.path.abspath(cached_path) != os.path.abspath(out_path):
+            # Swap in a new link so a file already at out_path is never written through
+            with atomic_output(out_path) as tmp:
+                try:
+                    os.link(cached_path, tmp)
+                except OSError:
+                    shutil.copyfile(cached_path, tmp)
+        return True
+    except Exception as e:
+        logger.warning(f'Cache hit for {cached_path} unusable: {e}')
+        with _lock:
+            if key in _entries:
+                _drop(key)
+            _hits -= 1
+            _misses += 1
+        return False
+
+
+def store(key, out_path):
+    """Record a freshly encoded output under key, evicting LRU entries over budget."""
+    global _bytes
+    try:
+        size = os.path.getsize(out_path)
+    except OSError:
+        return
+    with _lock:
+        if key in _entries:
+            _drop(key)
+        if out_path in _by_path:
+            _drop(_by_path[out_path])
+        _entries[key] = {'path': out_path, 'size': size}
+        _by_path[out_path] = key
+        _bytes += size
+        max_bytes = OUTPUT_CACHE_MAX_MB * 1024 * 1024
+        while _entries and (_bytes > max_bytes or len(_entries) > OUTPUT_CACHE_MAX_ENTRIES):
+            _drop(next(iter(_entries)))
+
+
+def discard_path(path):
+    """Forget the entry pointing at path (called when the file is deleted)."""
+    with _lock:
+        key = _by_path.get(path)
+        if key is not None:
+            _drop(key)
+
+
+def get_stats():
+    with _lock:
+        return {
+            'hits': _hits,
+            'misses': _misses,
+            'entries': len(_entries),
+            'bytes': _bytes,
+        }
+
+
+def _drop(key):
+    """Remove an entry. Caller must hold _lock."""
+    global _bytes
+    entry = _entries.pop(key)
+    _by_path.pop(entry['path'], None)
+    _bytes -= entry['size']
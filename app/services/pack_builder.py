@@ -0,0 +1,266 @@
+"""Incremental pack builds.
+
+Building a pack renders every sticker in Pack.sticker_ids (plus the icon from
+icon_sticker_id at ICON_SIZE) and bundles the outputs into one ZIP. A
+manifest per pack, kept in PACK_BUILDS_FOLDER, records for each entry the
+signature it was rendered with (the output-cache key: source content hash,
+type, format, mode and encoder limits) and the output file. A rebuild only
+re-renders entries whose signature changed or whose output is gone; the ZIP
+is only rewritten when the ordered list of outputs changed.
+
+Output names carry a digest of the whole signature, so an entry whose
+source or settings changed gets a new file instead of overwriting one that
+may still be hard-linked from the output cache or being served; encoders and
+cache hits install outputs by rename (utils.atomic_output), never in place.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from app.config import MAX_WORKERS, PACK_BUILDS_FOLDER
+from app.services import output_cache, storage, store
+from app.services.file_manager import invalidate_references, pinned, register_reference_provider
+from app.services.image_processor import resize_image
+from app.services.pack_manager import get_pack
+from app.services.video_processor import convert_video, convert_gif_to_video
+from app.utils import processing_type
+
+logger = logging.getLogger('telesticker.builds')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='pack-build')
+
+_locks_guard = threading.Lock()
+_locks = {}  # pack_id -> Lock serializing builds of that pack
+
+
+def _pack_lock(pack_id):
+    with _locks_guard:
+        return _locks.setdefault(pack_id, threading.Lock())
+
+
+def _manifest_path(pack_id):
+    return os.path.join(PACK_BUILDS_FOLDER, f'{pack_id}.json')
+
+
+def load_manifest(pack_id):
+    """The last build manifest of a pack, or None."""
+    try:
+        with open(_manifest_path(pack_id), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f'Unreadable build manifest for {pack_id}: {e}')
+        return None
+
+
+def _save_manifest(manifest):
+    os.makedirs(PACK_BUILDS_FOLDER, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PACK_BUILDS_FOLDER, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, _manifest_path(manifest['pack_id']))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def discard_manifest(pack_id):
+    """Forget a pack's build (its files are left to eviction)."""
+    try:
+        os.remove(_manifest_path(pack_id))
+    except OSError:
+        pass
+
+
+def _source_hash(sticker):
+    """sha256 of the sticker's upload, computed and stored once if unknown."""
+    if not sticker.content_hash:
+        sticker.content_hash = output_cache.hash_file(sticker.upload_path)
+        store.save_sticker(sticker)
+    return sticker.content_hash
+
+
+def _plan(pack):
+    """(key, sticker, mode) for every entry of the pack, icon last."""
+    plan = []
+    for file_id in dict.fromkeys(pack.get('sticker_ids', [])):
+        sticker = store.get_sticker(file_id)
+        if sticker is None:
+            raise ValueError(f'Sticker {file_id} not found')
+        plan.append((file_id, sticker, sticker.mode))
+    icon_id = pack.get('icon_sticker_id')
+    if icon_id:
+        sticker = store.get_sticker(icon_id)
+        if sticker is None:
+            raise ValueError(f'Icon sticker {icon_id} not found')
+        plan.append(('icon', sticker, 'icon'))
+    return plan
+
+
+def _render(pack_id, key, sticker, mode, signature, file_type):
+    """Render one entry to a fresh output. Returns (manifest entry, cache hit)."""
+    if file_type in ('animated_gif', 'video'):
+        ext = 'webm'
+    else:
+        ext = sticker.output_format if sticker.output_format in ('webp', 'png') else 'webp'
+    digest = hashlib.sha1(signature.encode()).hexdigest()[:16]
+    out_name = f'pack_{pack_id}_{key}_{digest}.{ext}'
+    out_path = storage.output_path(out_name)
+
+    cached = output_cache.lookup(signature, out_path)
+    if not cached:
+        is_icon = mode == 'icon'
+        if file_type in ('animated_gif', 'video'):
+            convert = convert_gif_to_video if file_type == 'animated_gif' else convert_video
+            ok = convert(sticker.upload_path, out_path, is_icon=is_icon, probe=sticker.probe)
+        else:
+            ok = resize_image(sticker.upload_path, out_path, sticker.output_format,
+                              is_icon=is_icon, is_emoji=mode == 'emoji')
+        if not ok:
+            raise RuntimeError(f'Failed to render {sticker.original_filename}')
+        output_cache.store(signature, out_path)
+
+    entry = {
+        'file_id': sticker.file_id,
+        'signature': signature,
+        'output': out_name,
+        'size': os.path.getsize(out_path),
+    }
+    return entry, cached
+
+
+def _write_zip(zip_path, members):
+    """Write the bundle next to its final path and swap it in."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(zip_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            for path, arcname in members:
+                # Outputs are WebP/WebM/PNG, already compressed
+                zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+        os.replace(tmp, zip_path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def build_pack(pack_id):
+    """Bring a pack's build up to date. Returns a summary dict, or None if the
+    pack doesn't exist. Raises ValueError if a sticker in the pack is missing
+    and RuntimeError if any entry fails to render."""
+    pack = get_pack(pack_id)
+    if pack is None:
+        return None
+
+    with _pack_lock(pack_id):
+        started = time.monotonic()
+        plan = _plan(pack)
+        previous = load_manifest(pack_id) or {}
+        old_entries = previous.get('entries', {})
+        sources = [s.upload_path for _, s, _ in plan]
+
+        with pinned(sources + [storage.output_path(e['output'], create=False)
+                               for e in old_entries.values()]):
+            entries = {}
+            stale = []
+            for key, sticker, mode in plan:
+                file_type = processing_type(sticker.file_type, sticker.upload_path)
+                signature = output_cache.make_key(_source_hash(sticker), file_type, sticker.output_format, mode)
+                old = old_entries.get(key)
+                if (old and old['signature'] == signature
+                        and os.path.isfile(storage.output_path(old['output'], create=False))):
+                    entries[key] = old
+                else:
+                    stale.append((key, sticker, mode, signature, file_type))
+
+            futures = {key: _executor.submit(_render, pack_id, key, sticker, mode, signature, file_type)
+                       for key, sticker, mode, signature, file_type in stale}
+            errors = []
+            cache_hits = 0
+            for key, future in futures.items():
+                try:
+                    entries[key], cached = future.result()
+                    cache_hits += cached
+                except Exception as e:
+                    logger.error(f'Pack {pack_id} build: {e}')
+                    errors.append(str(e))
+            if errors:
+                # Keep what did render so the next attempt only redoes the failures
+                _save_manifest(dict(previous, pack_id=pack_id, entries=dict(old_entries, **entries)))
+                raise RuntimeError('; '.join(errors))
+
+            members = []
+            for index, (key, _, _) in enumerate(plan):
+                output = entries[key]['output']
+                ext = output.rsplit('.', 1)[-1]
+                arcname = f'icon.{ext}' if key == 'icon' else f'sticker_{index + 1:03d}.{ext}'
+                members.append((storage.output_path(output, create=False), arcname))
+            bundle = [[os.path.basename(path), arcname] for path, arcname in members]
+
+            zip_name = f'pack_{pack_id}.zip'
+            zip_path = storage.output_path(zip_name)
+            rezip = bundle != previous.get('bundle') or not os.path.isfile(zip_path)
+            if rezip:
+                _write_zip(zip_path, members)
+
+        manifest = {
+            'pack_id': pack_id,
+            'built_at': time.time(),
+            'pack_updated_at': pack.get('updated_at', ''),
+            'entries': {key: entries[key] for key, _, _ in plan},
+            'bundle': bundle,
+            'zip_name': zip_name,
+        }
+        _save_manifest(manifest)
+        invalidate_references()
+
+        # Outputs of entries that changed or left the pack are no longer needed
+        live = {e['output'] for e in manifest['entries'].values()}
+        for old in old_entries.values():
+            if old['output'] not in live:
+                try:
+                    os.remove(storage.output_path(old['output'], create=False))
+                except OSError:
+                    pass
+
+        elapsed = time.monotonic() - started
+        logger.info(f'Built pack {pack_id}: {len(stale)} rendered, '
+                    f'{len(plan) - len(stale)} reused in {elapsed:.2f}s')
+        return {
+            'pack_id': pack_id,
+            'rendered': [key for key, *_ in stale],
+            'reused': len(plan) - len(stale),
+            'cache_hits': cache_hits,
+            'rezipped': rezip,
+            'seconds': round(elapsed, 3),
+            'download_url': f'/api/download/{zip_name}',
+            'entries': manifest['entries'],
+        }
+
+
+def _build_files():
+    """Outputs and bundles of every existing pack's last build (never evicted)."""
+    paths = []
+    if not os.path.isdir(PACK_BUILDS_FOLDER):
+        return paths
+    with os.scandir(PACK_BUILDS_FOLDER) as it:
+        pack_ids = [e.name[:-len('.json')] for e in it if e.name.endswith('.json')]
+    for pack_id in pack_ids:
+        manifest = load_manifest(pack_id)
+        if not manifest or get_pack(pack_id) is None:
+            continue
+        names = [e['output'] for e in manifest.get('entries', {}).values()]
+        names.append(manifest.get('zip_name'))
+        paths.extend(storage.output_path(n, create=False) for n in names if n)
+    return paths
+
+
+register_reference_provider(_build_files)
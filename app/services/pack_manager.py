@@ -1,15 +1,51 @@
-"""Sticker pack management with JSON persistence."""
+"""Sticker pack management with JSON persistence.
+
+Packs are served from an in-memory index of PACKS_FOLDER, loaded on first
+use. Every create/update/delete goes through _write/_remove, which update
+the index at once (so reads see the change immediately) and queue the pack
+for a write-behind flush. Edits arriving within PACK_FLUSH_DELAY_SECONDS are
+merged into one write; each file is replaced atomically (temp file, fsync,
+rename), and anything pending is flushed at process exit.
+
+Changes made behind our back (another process, a hand edit) are picked up by
+re-statting the folder at most every PACK_INDEX_RECHECK_SECONDS and
+reloading only files whose mtime changed; packs with unflushed edits keep
+their pending state.
+"""
 
 import os
 import json
+import time
 import uuid
+import atexit
 import logging
+import tempfile
+import threading
 from datetime import datetime
-from app.config import PACKS_FOLDER
+from app.config import PACKS_FOLDER, PACK_INDEX_RECHECK_SECONDS, PACK_FLUSH_DELAY_SECONDS
 from app.models.pack import Pack
+from app.services import store
+from app.services.file_manager import invalidate_references, register_reference_provider
 
 logger = logging.getLogger('telesticker.packs')
 
+SORT_KEYS = {
+    'updated_at': lambda p: p.get('updated_at', ''),
+    'created_at': lambda p: p.get('created_at', ''),
+    'name': lambda p: (p.get('name', '').lower(), p.get('pack_id', '')),
+}
+
+_lock = threading.RLock()
+_packs = {}  # pack_id -> pack dict
+_mtimes = {}  # pack_id -> file mtime_ns as last loaded or written
+_sorted = {}  # (sort, descending) -> [pack_id], cleared on any change
+_checked_at = None
+
+_DELETED = object()
+_dirty = {}  # pack_id -> pack dict, or _DELETED, awaiting flush
+_flush_lock = threading.Lock()  # serializes flushes
+_timer = None
+
 
 def _ensure_dir():
     os.makedirs(PACKS_FOLDER, exist_ok=True)
@@ -19,65 +55,217 @@ def _pack_path(pack_id):
     return os.path.join(PACKS_FOLDER, f'{pack_id}.json')
 
 
-def list_packs():
-    """Return list of all saved packs."""
+def _copy(pack):
+    return dict(pack, sticker_ids=list(pack.get('sticker_ids', [])))
+
+
+def _refresh():
+    """Sync the index with PACKS_FOLDER if the recheck interval has passed.
+    Caller must hold _lock."""
+    global _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < PACK_INDEX_RECHECK_SECONDS:
+        return
+    first_load = _checked_at is None
+    _checked_at = now
     _ensure_dir()
-    packs = []
-    for fname in os.listdir(PACKS_FOLDER):
-        if fname.endswith('.json'):
+
+    seen = set()
+    with os.scandir(PACKS_FOLDER) as it:
+        for entry in it:
+            if first_load and entry.name.endswith('.tmp'):
+                # Left over from a flush interrupted by a crash
+                os.remove(entry.path)
+                continue
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            pack_id = entry.name[:-len('.json')]
+            seen.add(pack_id)
+            if pack_id in _dirty:
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+                if _mtimes.get(pack_id) == mtime:
+                    continue
+                with open(entry.path, 'r') as f:
+                    _packs[pack_id] = json.load(f)
+                _mtimes[pack_id] = mtime
+                _sorted.clear()
+            except Exception as e:
+                logger.warning(f'Failed to load pack {entry.name}: {e}')
+
+    for pack_id in set(_packs) - seen - set(_dirty):
+        _packs.pop(pack_id, None)
+        _mtimes.pop(pack_id, None)
+        _sorted.clear()
+
+
+def _write(pack):
+    """The single write path: update the index and queue the pack for flushing."""
+    with _lock:
+        _refresh()
+        _packs[pack['pack_id']] = pack
+        _dirty[pack['pack_id']] = pack
+        _sorted.clear()
+        _schedule_flush()
+    # The pack may now reference files eviction considered free
+    invalidate_references()
+    return _copy(pack)
+
+
+def _remove(pack_id):
+    with _lock:
+        _refresh()
+        if _packs.pop(pack_id, None) is None:
+            return False
+        _dirty[pack_id] = _DELETED
+        _sorted.clear()
+        _schedule_flush()
+        return True
+
+
+def _schedule_flush():
+    """Start the write-behind timer if it isn't running. Caller must hold _lock."""
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(PACK_FLUSH_DELAY_SECONDS, flush)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _write_atomic(path, pack):
+    fd, tmp = tempfile.mkstemp(dir=PACKS_FOLDER, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(pack, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def flush():
+    """Write out every pending pack change (registered with atexit)."""
+    global _timer
+    with _flush_lock:
+        with _lock:
+            _timer = None
+            # Entries stay in _dirty until written so a refresh can't resurrect them
+            pending = dict(_dirty)
+        if not pending:
+            return
+
+        _ensure_dir()
+        failed = {}
+        written = {}
+        for pack_id, pack in pending.items():
+            path = _pack_path(pack_id)
             try:
-                with open(os.path.join(PACKS_FOLDER, fname), 'r') as f:
-                    packs.append(json.load(f))
+                if pack is _DELETED:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    _write_atomic(path, pack)
+                    written[pack_id] = os.stat(path).st_mtime_ns
             except Exception as e:
-                logger.warning(f'Failed to load pack {fname}: {e}')
-    return packs
+                logger.error(f'Failed to persist pack {pack_id}: {e}')
+                failed[pack_id] = pack
+
+        # Make the renames themselves durable
+        try:
+            dir_fd = os.open(PACKS_FOLDER, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+        with _lock:
+            for pack_id, pack in pending.items():
+                if pack_id in failed:
+                    continue
+                if pack is _DELETED:
+                    _mtimes.pop(pack_id, None)
+                else:
+                    _mtimes[pack_id] = written[pack_id]
+                # A newer change arrived meanwhile; it has its own flush queued
+                if _dirty.get(pack_id) is pack:
+                    del _dirty[pack_id]
+            if failed:
+                _schedule_flush()
+
+
+def list_packs():
+    """Return list of all saved packs."""
+    with _lock:
+        _refresh()
+        return [_copy(p) for p in _packs.values()]
+
+
+def query_packs(sort='updated_at', descending=True, offset=0, limit=None):
+    """One page of packs in the given order. Returns (packs, total)."""
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort key: {sort}')
+    with _lock:
+        _refresh()
+        order = _sorted.get((sort, descending))
+        if order is None:
+            ranked = sorted(_packs.values(), key=SORT_KEYS[sort], reverse=descending)
+            order = _sorted[(sort, descending)] = [p['pack_id'] for p in ranked]
+        end = None if limit is None else offset + limit
+        return [_copy(_packs[pid]) for pid in order[offset:end]], len(order)
 
 
 def get_pack(pack_id):
     """Load a single pack by ID."""
-    path = _pack_path(pack_id)
-    if not os.path.exists(path):
-        return None
-    with open(path, 'r') as f:
-        return json.load(f)
+    with _lock:
+        _refresh()
+        pack = _packs.get(pack_id)
+        return _copy(pack) if pack else None
 
 
 def create_pack(name, title, author=''):
     """Create a new pack and save to disk."""
-    _ensure_dir()
     pack_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
     pack = Pack(
         pack_id=pack_id, name=name, title=title, author=author,
         created_at=now, updated_at=now
     )
-    _save(pack)
-    return pack.to_dict()
+    return _write(pack.to_dict())
 
 
 def update_pack(pack_id, data):
     """Update pack fields and save."""
-    existing = get_pack(pack_id)
-    if not existing:
-        return None
-    for key in ('name', 'title', 'author', 'sticker_ids', 'icon_sticker_id'):
-        if key in data:
-            existing[key] = data[key]
-    existing['updated_at'] = datetime.utcnow().isoformat()
-    with open(_pack_path(pack_id), 'w') as f:
-        json.dump(existing, f, indent=2)
-    return existing
+    with _lock:
+        existing = get_pack(pack_id)
+        if not existing:
+            return None
+        for key in ('name', 'title', 'author', 'sticker_ids', 'icon_sticker_id'):
+            if key in data:
+                existing[key] = data[key]
+        existing['updated_at'] = datetime.utcnow().isoformat()
+        return _write(existing)
 
 
 def delete_pack(pack_id):
     """Delete a pack file."""
-    path = _pack_path(pack_id)
-    if os.path.exists(path):
-        os.remove(path)
-        return True
-    return False
+    return _remove(pack_id)
+
+
+def _pack_files():
+    """Files of every sticker in a saved pack (never evicted)."""
+    paths = []
+    for pack in list_packs():
+        for file_id in set(pack.get('sticker_ids', [])) | {pack.get('icon_sticker_id')}:
+            sticker = store.get_sticker(file_id) if file_id else None
+            if sticker:
+                paths.extend(store.sticker_files(sticker))
+    return paths
 
 
-def _save(pack):
-    with open(_pack_path(pack.pack_id), 'w') as f:
-        json.dump(pack.to_dict(), f, indent=2)
+register_reference_provider(_pack_files)
+atexit.register(flush)
@@ -0,0 +1,111 @@
+"""Bounded in-memory record stores with TTL and max-size eviction."""
+
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('telesticker.state')
+
+
+def approx_size(obj, _depth=0):
+    """Rough deep byte size of plain records (dicts, lists, dataclasses)."""
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set)):
+        for v in obj:
+            size += approx_size(v, _depth + 1)
+    elif hasattr(obj, '__dict__'):
+        size += approx_size(vars(obj), _depth + 1)
+    return size
+
+
+class ExpiringStore:
+    """Thread-safe mapping that drops entries idle longer than ttl seconds and
+    evicts least-recently-used entries beyond max_entries.
+
+    can_evict(value) may veto eviction (e.g. for a job that is still running);
+    vetoed entries are retried on the next prune.
+    """
+
+    def __init__(self, name, ttl, max_entries, can_evict=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._can_evict = can_evict or (lambda value: True)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, last_access)
+        self.evicted = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._data[key] = (item[0], time.time())
+            self._data.move_to_end(key)
+            return item[0]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            self._prune_locked()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def values(self):
+        """Live values, oldest access first."""
+        with self._lock:
+            self._prune_locked()
+            return [value for value, _ in self._data.values()]
+
+    def discard_where(self, predicate):
+        """Drop every entry whose value matches predicate. Returns the count."""
+        with self._lock:
+            keys = [k for k, (v, _) in self._data.items() if predicate(v)]
+            for k in keys:
+                del self._data[k]
+            self.evicted += len(keys)
+            return len(keys)
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked()
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.ttl
+        overflow = len(self._data) - self.max_entries
+        for key, (value, last_access) in list(self._data.items()):
+            # Oldest first: stop once nothing is expired and we're within bounds
+            if last_access >= cutoff and overflow <= 0:
+                break
+            if not self._can_evict(value):
+                continue
+            del self._data[key]
+            overflow -= 1
+            self.evicted += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'evicted': self.evicted,
+                'bytes': sum(approx_size(v) for v, _ in self._data.values()),
+            }
@@ -0,0 +1,108 @@
+"""Sharded on-disk layout for UPLOAD_FOLDER and OUTPUT_FOLDER.
+
+Files live in <root>/<shard>/<name>, where the shard is a prefix of the
+sha1 of the file's key: the leading file_id for per-sticker files
+('<file_id>_photo.png', '<file_id>_thumb.webp', '<file_id>_nobg.png') so
+they share a directory, or the whole name otherwise. A name therefore maps
+to exactly one path, with no directory scans or existence probes.
+
+Files left in the old flat layout are moved into their shards by
+migrate_flat() at startup, and relocate() maps stored flat paths to their
+sharded location.
+"""
+
+import os
+import re
+import hashlib
+import logging
+from app.config import UPLOAD_FOLDER, OUTPUT_FOLDER, STORAGE_SHARD_CHARS
+
+logger = logging.getLogger('telesticker.storage')
+
+ROOTS = (UPLOAD_FOLDER, OUTPUT_FOLDER)
+
+_FILE_ID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?=_)')
+
+
+def file_id_of(name):
+    """The sticker file_id a per-sticker file name starts with, or None."""
+    m = _FILE_ID.match(os.path.basename(name))
+    return m.group(0) if m else None
+
+
+def shard_of(name):
+    """Shard directory name for a file name."""
+    key = file_id_of(name) or name
+    return hashlib.sha1(key.encode()).hexdigest()[:STORAGE_SHARD_CHARS]
+
+
+def path_for(root, name, create=True):
+    """Sharded path of name under root, creating the shard directory if asked."""
+    name = os.path.basename(name)
+    shard = os.path.join(root, shard_of(name))
+    if create:
+        os.makedirs(shard, exist_ok=True)
+    return os.path.join(shard, name)
+
+
+def upload_path(name, create=True):
+    return path_for(UPLOAD_FOLDER, name, create)
+
+
+def output_path(name, create=True):
+    return path_for(OUTPUT_FOLDER, name, create)
+
+
+def resolve(name):
+    """Existing path of a stored file by name (uploads first), or None."""
+    for root in ROOTS:
+        path = path_for(root, name, create=False)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def relocate(path):
+    """Sharded location for a path stored in the old flat layout; other
+    paths are returned unchanged."""
+    if not path:
+        return path
+    parent = os.path.dirname(os.path.abspath(path))
+    for root in ROOTS:
+        if parent == os.path.abspath(root):
+            return path_for(root, path, create=False)
+    return path
+
+
+def iter_files(root):
+    """os.DirEntry for every file under root (shards, plus any flat leftovers)."""
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as top:
+        for entry in top:
+            if entry.is_dir(follow_symlinks=False):
+                with os.scandir(entry.path) as shard:
+                    for sub in shard:
+                        if sub.is_file(follow_symlinks=False):
+                            yield sub
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def migrate_flat():
+    """Move files from the flat layout into shards. Returns the count moved."""
+    moved = 0
+    for root in ROOTS:
+        if not os.path.isdir(root):
+            continue
+        with os.scandir(root) as it:
+            flat = [entry.name for entry in it if entry.is_file(follow_symlinks=False)]
+        for name in flat:
+            try:
+                os.replace(os.path.join(root, name), path_for(root, name))
+                moved += 1
+            except OSError as e:
+                logger.warning(f'Could not migrate {name}: {e}')
+    if moved:
+        logger.info(f'Migrated {moved} files to the sharded layout')
+    return moved
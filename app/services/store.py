@@ -0,0 +1,434 @@
+"""SQLite-backed sticker, job and resumable-upload store.
+
+Rows hold the JSON-serialized Sticker/Job plus indexed columns (session,
+status, type, created time, paths) for querying. The database runs in WAL mode
+with one connection per thread so Flask threads and job workers can read and
+write concurrently. Recently used records are kept in bounded in-memory caches
+in front of the database; running jobs are always kept there since workers
+mutate them in place and persist at state changes.
+"""
+
+import json
+import time
+import uuid
+import itertools
+import sqlite3
+import logging
+import threading
+from dataclasses import asdict, fields
+from app.config import DB_PATH, FILE_MAX_AGE_HOURS, STICKER_STORE_MAX_ENTRIES, JOB_STORE_MAX_ENTRIES
+from app.models.sticker import Sticker
+from app.models.job import Job
+from app.services.file_manager import invalidate_references, register_cleanup_hook, register_reference_provider
+from app.services import storage
+from app.services.state_store import ExpiringStore
+
+logger = logging.getLogger('telesticker.store')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stickers (
+    file_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    upload_path TEXT,
+    processed_path TEXT,
+    content_hash TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stickers_session ON stickers (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_stickers_status ON stickers (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_stickers_created ON stickers (created_at);
+CREATE INDEX IF NOT EXISTS idx_stickers_upload ON stickers (upload_path);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    zip_path TEXT,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_updated ON uploads (updated_at);
+"""
+
+_local = threading.local()
+_EPOCH = uuid.uuid4().hex[:8]  # distinguishes change tokens across restarts
+_version_counter = itertools.count(1)
+_sticker_version = 0
+_init_lock = threading.Lock()
+_initialized = False
+_recovered = False  # leftovers of the last run settled (serving process)
+
+_sticker_cache = ExpiringStore('stickers', ttl=FILE_MAX_AGE_HOURS * 3600, max_entries=STICKER_STORE_MAX_ENTRIES)
+_job_cache = ExpiringStore(
+    'jobs', ttl=FILE_MAX_AGE_HOURS * 3600, max_entries=JOB_STORE_MAX_ENTRIES,
+    can_evict=lambda job: job.status not in ('pending', 'processing'),
+)
+
+
+def _conn():
+    """Per-thread connection; the schema is created on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _init(conn)
+    return conn
+
+
+def _init(conn):
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(stickers)')}
+        if 'content_hash' not in columns:
+            conn.execute("ALTER TABLE stickers ADD COLUMN content_hash TEXT NOT NULL DEFAULT ''")
+        if 'processed_path' not in columns:
+            conn.execute('ALTER TABLE stickers ADD COLUMN processed_path TEXT')
+            conn.execute("UPDATE stickers SET processed_path = json_extract(data, '$.processed_path')")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_stickers_hash ON stickers (content_hash, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_stickers_processed ON stickers (processed_path)')
+        if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            _relocate_paths(conn)
+            conn.execute('PRAGMA user_version = 1')
+        conn.commit()
+        _initialized = True
+
+
+def _relocate_paths(conn):
+    """Point records written before the sharded layout at their new paths."""
+    for (data,) in conn.execute('SELECT data FROM stickers').fetchall():
+        sticker = _sticker_from_row(data)
+        sticker.upload_path = storage.relocate(sticker.upload_path)
+        sticker.processed_path = storage.relocate(sticker.processed_path)
+        sticker.bg_removed_path = storage.relocate(sticker.bg_removed_path)
+        _write_sticker(conn, sticker)
+    for (data,) in conn.execute('SELECT data FROM jobs').fetchall():
+        job = _job_from_row(data)
+        job.zip_path = storage.relocate(job.zip_path)
+        for result in job.file_results:
+            result['path'] = storage.relocate(result.get('path'))
+        _write_job(conn, job)
+
+
+def init_db():
+    """Open the database and settle records left over from the last run.
+
+    Serving process only: pool workers also open the store, and must never
+    touch the jobs and stickers the server is working on.
+    """
+    global _recovered
+    conn = _conn()
+    with _init_lock:
+        if _recovered:
+            return
+        _recovered = True
+    # Jobs running when the process died can never finish
+    for (data,) in conn.execute("SELECT data FROM jobs WHERE status IN ('pending', 'processing')").fetchall():
+        job = _job_from_row(data)
+        job.status = 'error'
+        job.error_message = 'Interrupted by server restart.'
+        _write_job(conn, job)
+    # Nor can their stickers, or analyses queued in memory
+    for (data,) in conn.execute(
+            "SELECT data FROM stickers WHERE status IN ('analyzing', 'processing')").fetchall():
+        sticker = _sticker_from_row(data)
+        sticker.status = 'uploaded'
+        _write_sticker(conn, sticker)
+    conn.commit()
+
+
+def _from_row(cls, data):
+    values = json.loads(data)
+    names = {f.name for f in fields(cls)}
+    return cls(**{k: v for k, v in values.items() if k in names})
+
+
+def _sticker_from_row(data):
+    return _from_row(Sticker, data)
+
+
+def _job_from_row(data):
+    return _from_row(Job, data)
+
+
+# --- Stickers ---
+
+def get_sticker(file_id):
+    """Return the Sticker for file_id, or None."""
+    sticker = _sticker_cache.get(file_id)
+    if sticker is not None:
+        return sticker
+    row = _conn().execute('SELECT data FROM stickers WHERE file_id = ?', (file_id,)).fetchone()
+    if row is None:
+        return None
+    sticker = _sticker_from_row(row[0])
+    _sticker_cache[file_id] = sticker
+    return sticker
+
+
+def sticker_change_token():
+    """Opaque token that changes whenever any sticker record is written or removed."""
+    return f'{_EPOCH}-{_sticker_version}'
+
+
+def _bump_sticker_version():
+    global _sticker_version
+    _sticker_version = next(_version_counter)
+
+
+def save_sticker(sticker):
+    """Insert or update a sticker record."""
+    if not sticker.created_at:
+        sticker.created_at = time.time()
+        # A new sticker's files are live from now on
+        invalidate_references()
+    conn = _conn()
+    with conn:
+        _write_sticker(conn, sticker)
+    _sticker_cache[sticker.file_id] = sticker
+    _bump_sticker_version()
+    return sticker
+
+
+def _write_sticker(conn, sticker):
+    conn.execute(
+        'INSERT OR REPLACE INTO stickers '
+        '(file_id, session_id, status, file_type, upload_path, processed_path, content_hash, created_at, data) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (sticker.file_id, sticker.session_id, sticker.status, sticker.file_type, sticker.upload_path,
+         sticker.processed_path, sticker.content_hash, sticker.created_at, json.dumps(asdict(sticker))),
+    )
+
+
+def delete_sticker(file_id):
+    """Remove a sticker record. Returns the removed Sticker or None."""
+    sticker = get_sticker(file_id)
+    if sticker is None:
+        return None
+    conn = _conn()
+    with conn:
+        conn.execute('DELETE FROM stickers WHERE file_id = ?', (file_id,))
+    _sticker_cache.pop(file_id)
+    _bump_sticker_version()
+    return sticker
+
+
+def get_all_stickers(session_id=None, status=None, file_type=None, after=None, limit=None):
+    """Stickers matching the given filters, oldest first.
+
+    after is a (created_at, file_id) keyset cursor: only stickers strictly
+    after it are returned, so pages stay stable while new uploads arrive.
+    """
+    clauses, params = [], []
+    for column, value in (('session_id', session_id), ('status', status), ('file_type', file_type)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    if after is not None:
+        clauses.append('(created_at > ? OR (created_at = ? AND file_id > ?))')
+        params.extend([after[0], after[0], after[1]])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f'SELECT file_id, data FROM stickers {where} ORDER BY created_at, file_id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    rows = _conn().execute(sql, params).fetchall()
+    # Prefer live cached objects so callers see in-flight mutations
+    return [_sticker_cache.get(file_id) or _sticker_from_row(data) for file_id, data in rows]
+
+
+def find_stickers_by_hash(content_hash, limit=5):
+    """Stickers whose upload has the given sha256, newest first."""
+    if not content_hash:
+        return []
+    rows = _conn().execute(
+        'SELECT file_id, data FROM stickers WHERE content_hash = ? ORDER BY created_at DESC LIMIT ?',
+        (content_hash, limit),
+    ).fetchall()
+    return [_sticker_cache.get(file_id) or _sticker_from_row(data) for file_id, data in rows]
+
+
+def sticker_files(sticker):
+    """Every file on disk belonging to a sticker."""
+    paths = [sticker.upload_path, sticker.processed_path, sticker.bg_removed_path]
+    if sticker.thumbnail_url:
+        paths.append(storage.upload_path(sticker.thumbnail_url.rsplit('/', 1)[-1], create=False))
+    return [p for p in paths if p]
+
+
+def _live_sticker_files():
+    """Files of stickers younger than FILE_MAX_AGE_HOURS or being analyzed or
+    processed (never evicted): users may still be editing them."""
+    cutoff = time.time() - FILE_MAX_AGE_HOURS * 3600
+    rows = _conn().execute(
+        "SELECT file_id, data FROM stickers WHERE created_at >= ? "
+        "UNION SELECT file_id, data FROM stickers WHERE status IN ('analyzing', 'processing')",
+        (cutoff,),
+    ).fetchall()
+    paths = []
+    for file_id, data in rows:
+        paths.extend(sticker_files(_sticker_cache.get(file_id) or _sticker_from_row(data)))
+    return paths
+
+
+# --- Jobs ---
+
+def get_job(job_id):
+    """Return the Job for job_id, or None."""
+    job = _job_cache.get(job_id)
+    if job is not None:
+        return job
+    row = _conn().execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = _job_from_row(row[0])
+    _job_cache[job_id] = job
+    return job
+
+
+def save_job(job):
+    """Insert or update a job record (called at state changes, not per file)."""
+    if not job.created_at:
+        job.created_at = time.time()
+    conn = _conn()
+    with conn:
+        _write_job(conn, job)
+    _job_cache[job.job_id] = job
+    return job
+
+
+def _write_job(conn, job):
+    conn.execute(
+        'INSERT OR REPLACE INTO jobs (job_id, session_id, status, zip_path, created_at, data) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (job.job_id, job.session_id, job.status, job.zip_path, job.created_at, json.dumps(asdict(job))),
+    )
+
+
+# --- Resumable upload sessions ---
+
+def save_upload(upload_id, data):
+    """Insert or update a resumable upload's metadata (a JSON-able dict)."""
+    conn = _conn()
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO uploads (upload_id, updated_at, data) VALUES (?, ?, ?)',
+            (upload_id, time.time(), json.dumps(data)),
+        )
+
+
+def get_upload(upload_id):
+    """(data, updated_at) of a stored upload session, or None."""
+    row = _conn().execute('SELECT data, updated_at FROM uploads WHERE upload_id = ?', (upload_id,)).fetchone()
+    return (json.loads(row[0]), row[1]) if row else None
+
+
+def delete_upload(upload_id):
+    conn = _conn()
+    with conn:
+        conn.execute('DELETE FROM uploads WHERE upload_id = ?', (upload_id,))
+
+
+def pop_uploads_before(cutoff):
+    """Remove upload sessions idle since before cutoff. Returns their data."""
+    conn = _conn()
+    with conn:
+        rows = conn.execute('SELECT data FROM uploads WHERE updated_at < ?', (cutoff,)).fetchall()
+        conn.execute('DELETE FROM uploads WHERE updated_at < ?', (cutoff,))
+    return [json.loads(data) for (data,) in rows]
+
+
+def get_uploads():
+    """Data of every stored upload session."""
+    return [json.loads(data) for (data,) in _conn().execute('SELECT data FROM uploads').fetchall()]
+
+
+def get_stats():
+    conn = _conn()
+    return {
+        'stickers': dict(_sticker_cache.get_stats(), rows=conn.execute('SELECT COUNT(*) FROM stickers').fetchone()[0]),
+        'jobs': dict(_job_cache.get_stats(), rows=conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]),
+    }
+
+
+def _stickers_referencing(conn, removed):
+    """Stickers whose processed output, background-removed image or thumbnail
+    is among removed paths (uploads are handled by deleting the record)."""
+    found = {}
+    for path in removed:
+        rows = conn.execute('SELECT file_id, data FROM stickers WHERE processed_path = ?', (path,)).fetchall()
+        file_id = storage.file_id_of(path)
+        if file_id:
+            rows += conn.execute('SELECT file_id, data FROM stickers WHERE file_id = ?', (file_id,)).fetchall()
+        for file_id, data in rows:
+            if file_id not in found:
+                found[file_id] = _sticker_cache.get(file_id) or _sticker_from_row(data)
+    return list(found.values())
+
+
+def _forget_files(sticker, removed):
+    """Clear a sticker's references to evicted files. Returns True if changed."""
+    changed = False
+    if sticker.processed_path in removed:
+        sticker.processed_path = None
+        if sticker.status == 'processed':
+            sticker.status = 'uploaded'
+        changed = True
+    if sticker.bg_removed_path in removed:
+        sticker.bg_removed_path = None
+        sticker.use_bg_removed = False
+        changed = True
+    if sticker.thumbnail_url:
+        thumb = storage.upload_path(sticker.thumbnail_url.rsplit('/', 1)[-1], create=False)
+        if thumb in removed:
+            sticker.thumbnail_url = None
+            sticker.thumbnail_path = None
+            changed = True
+    return changed
+
+
+def _on_cleanup(removed):
+    """Drop records whose uploads the cleanup sweep deleted, clear references
+    to other evicted files (so e.g. a sticker whose output went is simply
+    'uploaded' again), and drop expired jobs."""
+    conn = _conn()
+    cutoff = time.time() - FILE_MAX_AGE_HOURS * 3600
+    updated = []
+    with conn:
+        for path in removed:
+            conn.execute('DELETE FROM stickers WHERE upload_path = ?', (path,))
+        for sticker in _stickers_referencing(conn, removed):
+            if sticker.upload_path not in removed and _forget_files(sticker, removed):
+                _write_sticker(conn, sticker)
+                updated.append(sticker)
+        conn.execute(
+            "DELETE FROM jobs WHERE created_at < ? AND status NOT IN ('pending', 'processing')", (cutoff,)
+        )
+    _sticker_cache.discard_where(lambda s: s.upload_path in removed)
+    for sticker in updated:
+        _sticker_cache[sticker.file_id] = sticker
+    _sticker_cache.prune()
+    if removed:
+        _bump_sticker_version()
+    _job_cache.discard_where(lambda j: j.created_at < cutoff and j.status not in ('pending', 'processing'))
+    _job_cache.prune()
+
+
+register_cleanup_hook(_on_cleanup)
+register_reference_provider(_live_sticker_files)
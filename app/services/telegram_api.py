@@ -1,29 +1,78 @@
-"""Telegram Bot API client for sticker set management."""
+"""Telegram Bot API client for sticker set management.
 
+All calls share one httpx.Client per process, so connections to the Bot API
+are pooled and kept alive across requests instead of re-handshaking for
+every sticker. The client is created on first use (and again in a forked
+child) and closed at exit.
+"""
+
+import os
+import json
+import atexit
 import logging
+import threading
+from contextlib import ExitStack
+from app.config import (
+    TELEGRAM_API_BASE, TELEGRAM_HTTP2, TELEGRAM_MAX_CONNECTIONS, TELEGRAM_MAX_KEEPALIVE,
+    TELEGRAM_KEEPALIVE_EXPIRY, TELEGRAM_CREATE_SET_MAX_STICKERS
+)
 
 logger = logging.getLogger('telesticker.telegram')
 
-_httpx = None
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
 
-def _get_httpx():
-    global _httpx
-    if _httpx is None:
-        import httpx
-        _httpx = httpx
-    return _httpx
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning('TELEGRAM_HTTP2 is set but the h2 package is not installed, using HTTP/1.1')
+        return False
+
+
+def _get_client():
+    """The shared client, created on first use. httpx.Client is thread-safe."""
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import httpx
+            _client = httpx.Client(
+                http2=TELEGRAM_HTTP2 and _http2_available(),
+                limits=httpx.Limits(
+                    max_connections=TELEGRAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=TELEGRAM_MAX_KEEPALIVE,
+                    keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+                ),
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def close():
+    """Close the shared client and its pooled connections (registered with atexit)."""
+    global _client
+    with _client_lock:
+        # A client inherited across fork belongs to the parent's sockets
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
 
 
 def _api_url(token, method):
-    return f'https://api.telegram.org/bot{token}/{method}'
+    return f'{TELEGRAM_API_BASE.rstrip("/")}/bot{token}/{method}'
 
 
 def validate_token(token):
     """Validate a bot token, returns bot info dict or None."""
-    httpx = _get_httpx()
+    client = _get_client()
     try:
-        r = httpx.get(_api_url(token, 'getMe'), timeout=10)
+        r = client.get(_api_url(token, 'getMe'), timeout=10)
         data = r.json()
         if data.get('ok'):
             return data['result']
@@ -33,46 +82,51 @@ def validate_token(token):
         return None
 
 
+def _input_sticker(sticker, attach_name):
+    """InputSticker JSON for a sticker dict whose file is sent as attach_name."""
+    return {
+        'sticker': f'attach://{attach_name}',
+        'format': sticker.get('format', 'static'),
+        'emoji_list': [sticker.get('emoji', '🎨')],
+    }
+
+
 def create_sticker_set(token, user_id, name, title, stickers):
     """Create a new sticker set.
     stickers: list of dicts with 'file_path', 'emoji', 'format' ('static'/'video')
+
+    The first TELEGRAM_CREATE_SET_MAX_STICKERS stickers go into the
+    createNewStickerSet call itself, each file as its own multipart part;
+    only the rest are added one by one.
     """
-    httpx = _get_httpx()
+    client = _get_client()
     try:
-        first = stickers[0]
-        files = {}
+        batch = stickers[:TELEGRAM_CREATE_SET_MAX_STICKERS]
         data = {
             'user_id': user_id,
             'name': name,
             'title': title,
-            'sticker_format': first.get('format', 'static'),
+            # Pre-7.2 servers read the format per set rather than per sticker
+            'sticker_format': batch[0].get('format', 'static'),
+            'stickers': json.dumps([_input_sticker(s, f'sticker_{i}') for i, s in enumerate(batch)]),
         }
 
-        # Build sticker input for first sticker
-        sticker_data = {
-            'emoji_list': [first.get('emoji', '🎨')],
-        }
-
-        with open(first['file_path'], 'rb') as f:
-            file_bytes = f.read()
-
-        # Use input_sticker format
-        import json as _json
-        sticker_data['sticker'] = 'attach://sticker_file'
-        data['stickers'] = _json.dumps([sticker_data])
-        files['sticker_file'] = ('sticker', file_bytes)
-
-        r = httpx.post(
-            _api_url(token, 'createNewStickerSet'),
-            data=data, files=files, timeout=30
-        )
+        with ExitStack() as stack:
+            files = {
+                f'sticker_{i}': ('sticker', stack.enter_context(open(s['file_path'], 'rb')))
+                for i, s in enumerate(batch)
+            }
+            r = client.post(
+                _api_url(token, 'createNewStickerSet'),
+                data=data, files=files, timeout=30 + 2 * len(batch)
+            )
         result = r.json()
         if not result.get('ok'):
             return {'ok': False, 'error': result.get('description', 'Unknown error')}
 
-        # Add remaining stickers
+        # Add remaining stickers, in order
         errors = []
-        for i, s in enumerate(stickers[1:], start=2):
+        for i, s in enumerate(stickers[len(batch):], start=len(batch) + 1):
             res = add_sticker_to_set(token, user_id, name, s)
             if not res.get('ok'):
                 errors.append(f'Sticker {i}: {res.get("error", "failed")}')
@@ -85,28 +139,18 @@ def create_sticker_set(token, user_id, name, title, stickers):
 
 def add_sticker_to_set(token, user_id, name, sticker):
     """Add a single sticker to an existing set."""
-    httpx = _get_httpx()
+    client = _get_client()
     try:
-        import json as _json
-        sticker_data = {
-            'emoji_list': [sticker.get('emoji', '🎨')],
-            'sticker': 'attach://sticker_file',
-        }
-
-        with open(sticker['file_path'], 'rb') as f:
-            file_bytes = f.read()
-
         data = {
             'user_id': user_id,
             'name': name,
-            'sticker': _json.dumps(sticker_data),
+            'sticker': json.dumps(_input_sticker(sticker, 'sticker_file')),
         }
-        files = {'sticker_file': ('sticker', file_bytes)}
-
-        r = httpx.post(
-            _api_url(token, 'addStickerToSet'),
-            data=data, files=files, timeout=30
-        )
+        with open(sticker['file_path'], 'rb') as f:
+            r = client.post(
+                _api_url(token, 'addStickerToSet'),
+                data=data, files={'sticker_file': ('sticker', f)}, timeout=30
+            )
         result = r.json()
         if result.get('ok'):
             return {'ok': True}
@@ -117,9 +161,9 @@ def add_sticker_to_set(token, user_id, name, sticker):
 
 def get_sticker_set(token, name):
     """Get sticker set info."""
-    httpx = _get_httpx()
+    client = _get_client()
     try:
-        r = httpx.get(
+        r = client.get(
             _api_url(token, 'getStickerSet'),
             params={'name': name}, timeout=10
         )
@@ -130,3 +174,6 @@ def get_sticker_set(token, name):
     except Exception as e:
         logger.error(f'Get sticker set failed: {e}')
         return None
+
+
+atexit.register(close)
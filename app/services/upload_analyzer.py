@@ -0,0 +1,94 @@
+"""Background post-upload analysis.
+
+Uploads are stored with status 'analyzing' and returned immediately; the
+thumbnail, image metadata and ffprobe result are filled in here on a small
+thread pool, and a file_analyzed event is pushed when each file is done.
+"""
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.config import ANALYSIS_WORKERS
+from app.services import file_manager, storage, store
+from app.services.image_processor import analyze_image
+from app.services.video_processor import generate_video_thumbnail, probe_video
+
+logger = logging.getLogger('telesticker.analyzer')
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analyze')
+
+
+def submit_analysis(sticker, socketio, sid=None):
+    """Queue analysis of a freshly uploaded sticker."""
+    # Kept from eviction until analyzed
+    file_manager.pin(sticker.upload_path)
+    _executor.submit(_analyze, sticker, socketio, sid)
+
+
+def _analyze(sticker, socketio, sid):
+    metadata, warning = {}, None
+    try:
+        metadata = _read_metadata(sticker)
+    except Exception as e:
+        logger.error(f'Analysis failed for {sticker.file_id}: {e}')
+        warning = f'Analysis failed: {e}'
+    finally:
+        file_manager.unpin(sticker.upload_path)
+
+    # The record may have been deleted or edited while we worked
+    current = store.get_sticker(sticker.file_id)
+    if current is None:
+        _discard_thumbnail(metadata)
+        return
+    for name, value in metadata.items():
+        setattr(current, name, value)
+    if warning:
+        current.warnings.append(warning)
+    # Processing may already have been requested for this file
+    if current.status == 'analyzing':
+        current.status = 'uploaded'
+    store.save_sticker(current)
+
+    data = current.to_dict()
+    if sid:
+        socketio.emit('file_analyzed', data, to=sid)
+    else:
+        socketio.emit('file_analyzed', data)
+
+
+def _discard_thumbnail(metadata):
+    url = metadata.get('thumbnail_url')
+    if url:
+        try:
+            os.remove(storage.upload_path(url.rsplit('/', 1)[-1], create=False))
+        except OSError:
+            pass
+
+
+def _read_metadata(sticker):
+    """Thumbnail, dimensions and probe of a sticker's upload, as Sticker fields."""
+    metadata = {}
+    thumb_name = f'{sticker.file_id}_thumb.webp'
+    thumb_path = storage.upload_path(thumb_name)
+
+    if sticker.file_type in ('image', 'animated_gif'):
+        info = analyze_image(sticker.upload_path, thumb_path) or {}
+        if info.get('thumbnail'):
+            metadata['thumbnail_url'] = f'/api/preview/{thumb_name}'
+        metadata['has_transparency'] = info.get('has_transparency', False)
+        # Check if it's an animated GIF
+        if (sticker.file_type == 'image' and sticker.upload_path.lower().endswith('.gif')
+                and info.get('frames', 1) > 1):
+            metadata['file_type'] = 'animated_gif'
+    elif sticker.file_type == 'video':
+        video_thumb = thumb_path.rsplit('.', 1)[0] + '.jpg'
+        if generate_video_thumbnail(sticker.upload_path, video_thumb):
+            metadata['thumbnail_url'] = f'/api/preview/{os.path.basename(video_thumb)}'
+        metadata['probe'] = probe_video(sticker.upload_path)
+        info = metadata['probe'] or {}
+    else:
+        info = {}
+
+    metadata['width'] = info.get('width', 0)
+    metadata['height'] = info.get('height', 0)
+    return metadata
@@ -2,18 +2,64 @@
 
 import os
 import json
+import shutil
 import logging
+import tempfile
+import threading
 import subprocess
+from collections import OrderedDict
 from app.config import (
     MAX_IMAGE_SIZE, MAX_VIDEO_DURATION, MAX_VIDEO_SIZE_KB,
-    ICON_SIZE, MAX_ICON_SIZE_KB, VIDEO_FPS, VIDEO_TIMEOUT
+    ICON_SIZE, MAX_ICON_SIZE_KB, VIDEO_FPS, VIDEO_TIMEOUT,
+    MAX_VIDEO_ATTEMPTS, MIN_VIDEO_BITRATE_KBPS, VIDEO_SIZE_HEADROOM, PROBE_CACHE_MAX_ENTRIES,
+    FFMPEG_THREADS
 )
+from app.services import ffmpeg_runner
+from app.utils import atomic_output
 
 logger = logging.getLogger('telesticker.video')
 
+_probe_lock = threading.Lock()
+_probe_cache = OrderedDict()  # path -> probe info (with 'stat' key)
+
+
+def _stat_key(filepath):
+    st = os.stat(filepath)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def rebind_probe(probe, filepath):
+    """Copy of a probe result keyed to filepath, which holds the same content
+    (e.g. a hard link to the probed file)."""
+    if not probe:
+        return probe
+    try:
+        return dict(probe, stat=_stat_key(filepath))
+    except OSError:
+        return dict(probe)
+
+
+def probe_video(filepath, cached=None):
+    """Extract video metadata using ffprobe.
+
+    Results carry the file's size/mtime under 'stat' and are memoized on
+    that key, so repeated probes of an unchanged file don't spawn ffprobe.
+    A previously returned result can be passed back in as cached.
+    """
+    try:
+        key = _stat_key(filepath)
+    except OSError:
+        key = None
+
+    if key is not None:
+        if cached and cached.get('stat') == key:
+            return cached
+        with _probe_lock:
+            hit = _probe_cache.get(filepath)
+            if hit and hit['stat'] == key:
+                _probe_cache.move_to_end(filepath)
+                return dict(hit)
 
-def probe_video(filepath):
-    """Extract video metadata using ffprobe."""
     try:
         cmd = [
             'ffprobe', '-v', 'error',
@@ -23,21 +69,31 @@ def probe_video(filepath):
             '-of', 'json',
             filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = ffmpeg_runner.run(cmd, priority=ffmpeg_runner.PRIORITY_INTERACTIVE,
+                                   capture_output=True, text=True, timeout=30)
         data = json.loads(result.stdout)
         stream = data.get('streams', [{}])[0]
         fmt = data.get('format', {})
-        return {
+        info = {
             'width': int(stream.get('width', 0)),
             'height': int(stream.get('height', 0)),
             'duration': float(fmt.get('duration', stream.get('duration', 0))),
             'codec': stream.get('codec_name', ''),
             'frames': int(stream.get('nb_frames', 0)),
+            'stat': key,
         }
     except Exception as e:
         logger.error(f'Video probe failed: {e}')
         return {'width': 1280, 'height': 720, 'duration': 0, 'codec': '', 'frames': 0}
 
+    if key is not None:
+        with _probe_lock:
+            _probe_cache[filepath] = dict(info)
+            _probe_cache.move_to_end(filepath)
+            while len(_probe_cache) > PROBE_CACHE_MAX_ENTRIES:
+                _probe_cache.popitem(last=False)
+    return info
+
 
 def generate_video_thumbnail(filepath, thumb_path):
     """Extract first frame as thumbnail."""
@@ -47,15 +103,79 @@ def generate_video_thumbnail(filepath, thumb_path):
             '-vframes', '1', '-q:v', '2',
             thumb_path
         ]
-        subprocess.run(cmd, capture_output=True, timeout=30)
+        ffmpeg_runner.run(cmd, priority=ffmpeg_runner.PRIORITY_INTERACTIVE, capture_output=True, timeout=30)
         return os.path.exists(thumb_path)
     except Exception as e:
         logger.error(f'Video thumbnail failed: {e}')
         return False
 
 
-def convert_video(input_path, output_path, is_icon=False, progress_callback=None):
-    """Convert video to WEBM VP9 for Telegram stickers with timeout."""
+# Share of a file's conversion time covered by each ffmpeg stage
+_STAGE_SPANS = {
+    'intermediate': (0.0, 0.2),
+    'pass1': (0.2, 0.5),
+    'pass2': (0.5, 1.0),
+}
+
+
+def _progress_int(value):
+    """ffmpeg reports 'N/A' for unknown progress fields."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def target_bitrate_kbps(duration, max_size_kb):
+    """Bitrate that fills max_size_kb over the clip, minus container overhead."""
+    if not duration or duration <= 0 or duration > MAX_VIDEO_DURATION:
+        duration = MAX_VIDEO_DURATION
+    budget_bits = max_size_kb * 1024 * 8 * VIDEO_SIZE_HEADROOM
+    return max(MIN_VIDEO_BITRATE_KBPS, int(budget_bits / duration / 1000))
+
+
+def make_intermediate(input_path, intermediate_path, video_filter, on_progress=None, cancel=None):
+    """Decode, trim and filter the source once into a lossless FFV1 file.
+
+    Returns the intermediate path, or None if it couldn't be made (callers
+    then encode straight from the source).
+    """
+    cmd = [
+        'ffmpeg', '-y', '-i', input_path,
+        '-t', str(MAX_VIDEO_DURATION),
+        '-vf', video_filter,
+        '-c:v', 'ffv1', '-level', '3', '-slices', '4',
+        '-threads', str(FFMPEG_THREADS),
+        '-pix_fmt', 'yuva420p',
+        '-an',
+        intermediate_path
+    ]
+    try:
+        ffmpeg_runner.run_with_progress(cmd, on_progress=on_progress, cancel=cancel, timeout=VIDEO_TIMEOUT)
+        return intermediate_path
+    except (subprocess.TimeoutExpired, ffmpeg_runner.FFmpegCancelled):
+        raise
+    except Exception as e:
+        logger.warning(f'Intermediate encode failed, using source directly: {e}')
+        return None
+
+
+def convert_video(input_path, output_path, is_icon=False, progress_callback=None, stats=None, probe=None,
+                  cancel=None):
+    """Convert video to WEBM VP9 for Telegram stickers with timeout.
+
+    The bitrate is predicted from the probed duration and size budget and
+    encoded in two passes from a pre-filtered intermediate, so the first
+    attempt normally fits and retries never re-decode the source. If stats is a
+    dict it receives 'attempts' and the final 'bitrate' (kbps). probe is a
+    stored probe_video result, reused if the file hasn't changed.
+
+    progress_callback(dict) receives live ffmpeg progress: attempt, stage,
+    frame, out_time (s) and fraction (0-1 of the whole file). cancel() is
+    polled while ffmpeg runs; returning True kills the encode.
+    """
+    attempts = 0
+    bitrate = None
     try:
         if not output_path.endswith('.webm'):
             output_path = output_path.rsplit('.', 1)[0] + '.webm'
@@ -63,7 +183,7 @@ def convert_video(input_path, output_path, is_icon=False, progress_callback=None
         target_size = ICON_SIZE if is_icon else MAX_IMAGE_SIZE
         max_size_kb = MAX_ICON_SIZE_KB if is_icon else MAX_VIDEO_SIZE_KB
 
-        info = probe_video(input_path)
+        info = probe_video(input_path, cached=probe)
         width = info['width'] or 1280
         height = info['height'] or 720
 
@@ -77,45 +197,94 @@ def convert_video(input_path, output_path, is_icon=False, progress_callback=None
             new_width = new_width + (new_width % 2)
             new_height = new_height + (new_height % 2)
 
-        bitrate = 150 if is_icon else 300
+        bitrate = target_bitrate_kbps(info['duration'], max_size_kb)
+        loop_filter = ',loop=0:32767:0' if is_icon else ''
+        video_filter = f'scale={new_width}:{new_height},fps={VIDEO_FPS}{loop_filter}'
+        encode = [
+            '-c:v', 'libvpx-vp9',
+            '-pix_fmt', 'yuva420p',
+            '-an',
+            '-deadline', 'good',
+            '-auto-alt-ref', '0',
+            *ffmpeg_runner.encoder_threads(),
+        ]
+
+        clip_seconds = info['duration'] if 0 < info['duration'] < MAX_VIDEO_DURATION else MAX_VIDEO_DURATION
+
+        def reporter(stage):
+            if not progress_callback:
+                return None
+            start, end = _STAGE_SPANS[stage]
 
-        for attempt in range(5):
-            loop_filter = ',loop=0:32767:0' if is_icon else ''
-            cmd = [
-                'ffmpeg', '-y', '-i', input_path,
-                '-t', str(MAX_VIDEO_DURATION),
-                '-vf', f'scale={new_width}:{new_height},fps={VIDEO_FPS}{loop_filter}',
-                '-c:v', 'libvpx-vp9',
-                '-pix_fmt', 'yuva420p',
-                '-an',
-                '-b:v', f'{bitrate}k',
-                '-crf', '30',
-                '-deadline', 'good',
-                '-auto-alt-ref', '0',
-                output_path
-            ]
+            def report(block):
+                seconds = _progress_int(block.get('out_time_us')) / 1e6
+                done = min(1.0, seconds / clip_seconds)
+                progress_callback({
+                    'attempt': attempts,
+                    'stage': stage,
+                    'frame': _progress_int(block.get('frame')),
+                    'out_time': round(seconds, 2),
+                    'fraction': start + (end - start) * done,
+                })
+            return report
 
-            subprocess.run(cmd, capture_output=True, check=True, timeout=VIDEO_TIMEOUT)
+        with tempfile.TemporaryDirectory(prefix='telesticker_video_') as tmp:
+            passlog = os.path.join(tmp, 'vp9')
+            # Attempts overwrite this; only a result that fits replaces output_path
+            encoded = os.path.join(tmp, 'sticker.webm')
 
-            file_size_kb = os.path.getsize(output_path) / 1024
-            if progress_callback:
-                progress_callback(attempt + 1, 5)
+            # Trim, scale and resample once; every pass/attempt reads the small intermediate
+            source = make_intermediate(input_path, os.path.join(tmp, 'intermediate.mkv'), video_filter,
+                                       on_progress=reporter('intermediate'), cancel=cancel)
+            if source:
+                common = ['-i', source, *encode]
+            else:
+                common = ['-i', input_path, '-t', str(MAX_VIDEO_DURATION), '-vf', video_filter, *encode]
 
-            if file_size_kb <= max_size_kb:
-                return True
+            for attempt in range(MAX_VIDEO_ATTEMPTS):
+                attempts = attempt + 1
+                rate = ['-b:v', f'{bitrate}k', '-passlogfile', passlog]
+                first_pass = ['ffmpeg', '-y', *common, *rate,
+                              '-pass', '1', '-cpu-used', '4', '-f', 'null', os.devnull]
+                second_pass = ['ffmpeg', '-y', *common, *rate,
+                               '-pass', '2', encoded]
 
-            bitrate = int(bitrate * 0.6)
+                ffmpeg_runner.run_with_progress(first_pass, on_progress=reporter('pass1'),
+                                                cancel=cancel, timeout=VIDEO_TIMEOUT)
+                ffmpeg_runner.run_with_progress(second_pass, on_progress=reporter('pass2'),
+                                                cancel=cancel, timeout=VIDEO_TIMEOUT)
+
+                file_size_kb = os.path.getsize(encoded) / 1024
+
+                if file_size_kb <= max_size_kb:
+                    with atomic_output(output_path) as part:
+                        shutil.copyfile(encoded, part)
+                    return True
+
+                # Scale by the observed overshoot rather than a fixed step
+                logger.info(f'{os.path.basename(input_path)}: {file_size_kb:.0f} KB at {bitrate}k, retrying')
+                bitrate = max(MIN_VIDEO_BITRATE_KBPS,
+                              int(bitrate * (max_size_kb / file_size_kb) * VIDEO_SIZE_HEADROOM))
 
         return False
 
+    except ffmpeg_runner.FFmpegCancelled:
+        logger.info(f'Video conversion cancelled: {os.path.basename(input_path)}')
+        return False
     except subprocess.TimeoutExpired:
         logger.error(f'Video conversion timed out after {VIDEO_TIMEOUT}s')
         return False
     except Exception as e:
         logger.error(f'Video conversion failed: {e}')
         return False
+    finally:
+        if stats is not None:
+            stats['attempts'] = attempts
+            stats['bitrate'] = bitrate
 
 
-def convert_gif_to_video(gif_path, output_path, is_icon=False, progress_callback=None):
+def convert_gif_to_video(gif_path, output_path, is_icon=False, progress_callback=None, stats=None, probe=None,
+                         cancel=None):
     """Convert animated GIF to WEBM video sticker."""
-    return convert_video(gif_path, output_path, is_icon=is_icon, progress_callback=progress_callback)
+    return convert_video(gif_path, output_path, is_icon=is_icon, progress_callback=progress_callback,
+                         stats=stats, probe=probe, cancel=cancel)
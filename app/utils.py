@@ -1,7 +1,9 @@
 """Utility functions for validation, file type detection, and logging."""
 
 import os
+import uuid
 import logging
+from contextlib import contextmanager
 from pathlib import Path
 from app.config import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, ANIMATED_EXTENSIONS
 
@@ -47,6 +49,13 @@ def is_animated_gif(filepath):
         return False
 
 
+def processing_type(file_type, filepath):
+    """The type a file is converted as: animated images are encoded as video."""
+    if file_type == 'image' and is_animated_gif(filepath):
+        return 'animated_gif'
+    return file_type
+
+
 def validate_file(filename, filesize=None):
     """Validate an uploaded file. Returns (valid, warnings) tuple."""
     warnings = []
@@ -61,6 +70,15 @@ def validate_file(filename, filesize=None):
     return True, warnings
 
 
+def get_session_id():
+    """Stable per-browser session id (stored in the signed Flask session cookie)."""
+    from flask import session
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+        session.permanent = True
+    return session['session_id']
+
+
 def format_size(size_bytes):
     """Format byte size to human-readable string."""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -68,3 +86,18 @@ def format_size(size_bytes):
             return f'{size_bytes:.1f} {unit}'
         size_bytes /= 1024
     return f'{size_bytes:.1f} TB'
+
+
+@contextmanager
+def atomic_output(path):
+    """Yield a not-yet-existing temp path next to path; when the block
+    succeeds it is renamed over path. Existing files at path are replaced,
+    never written through, so other hard links to them keep their content."""
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f'.{name}.{uuid.uuid4().hex[:12]}.tmp')
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
@@ -12,14 +12,47 @@ const API = {
         }
     },
 
-    async upload(files) {
+    async upload(files, sid) {
         const formData = new FormData();
         for (const file of files) {
             formData.append('files', file);
         }
+        if (sid) formData.append('sid', sid);
         return this._fetch('/api/upload', { method: 'POST', body: formData });
     },
 
+    // Resumable upload: chunks are retried from the server's acknowledged offset
+    async uploadResumable(file, sid, retries = 5) {
+        const init = await this._fetch('/api/upload/init', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size }),
+        });
+        const url = `/api/upload/${init.upload_id}`;
+        let offset = 0;
+        let failures = 0;
+        while (offset < file.size) {
+            try {
+                const res = await this._fetch(url, {
+                    method: 'PUT',
+                    headers: { 'Upload-Offset': String(offset) },
+                    body: file.slice(offset, offset + init.chunk_size),
+                });
+                offset = res.offset;
+                failures = 0;
+            } catch (err) {
+                if (++failures > retries) throw err;
+                await new Promise(r => setTimeout(r, 1000 * failures));
+                offset = (await this._fetch(url)).offset;
+            }
+        }
+        return this._fetch(`${url}/complete`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sid }),
+        });
+    },
+
     async process(fileConfigs, sid) {
         return this._fetch('/api/process', {
             method: 'POST',
@@ -53,8 +86,9 @@ const API = {
     },
 
     // Pack API
-    async listPacks() {
-        return this._fetch('/api/pack');
+    async listPacks(params = {}) {
+        const query = new URLSearchParams(params).toString();
+        return this._fetch(`/api/pack${query ? `?${query}` : ''}`);
     },
 
     async createPack(name, title) {
@@ -77,6 +111,10 @@ const API = {
         return this._fetch(`/api/pack/${packId}`, { method: 'DELETE' });
     },
 
+    async buildPack(packId) {
+        return this._fetch(`/api/pack/${packId}/build`, { method: 'POST' });
+    },
+
     // Telegram API
     async validateToken(token) {
         return this._fetch('/api/telegram/validate', {
@@ -11,6 +11,7 @@ const Pack = {
 
         document.getElementById('savePackBtn')?.addEventListener('click', () => this.savePack());
         document.getElementById('loadPackBtn')?.addEventListener('click', () => this.openLoadModal());
+        document.getElementById('buildPackBtn')?.addEventListener('click', () => this.buildPack());
         document.getElementById('closePackLoadBtn')?.addEventListener('click', () => {
             document.getElementById('packLoadModal').classList.remove('active');
         });
@@ -131,43 +132,73 @@ const Pack = {
         }
     },
 
+    async buildPack() {
+        // Build what was saved, so save pending edits first
+        await this.savePack();
+        if (!this._currentPackId) return;
+
+        try {
+            const result = await API.buildPack(this._currentPackId);
+            Utils.showToast(`Pack built: ${result.rendered.length} rendered, ${result.reused} unchanged`, 'success');
+            window.location.href = result.download_url;
+        } catch (err) {
+            Utils.showToast(`Build failed: ${err.message}`, 'error');
+        }
+    },
+
     async openLoadModal() {
         try {
-            const data = await API.listPacks();
             const list = document.getElementById('packList');
             list.innerHTML = '';
+            await this._loadPackPage(list, 0);
+            document.getElementById('packLoadModal').classList.add('active');
+        } catch (err) {
+            Utils.showToast(`Failed to load packs: ${err.message}`, 'error');
+        }
+    },
 
-            if (!data.packs || data.packs.length === 0) {
-                list.innerHTML = '<p style="color:var(--text-muted); text-align:center; padding:20px">No saved packs</p>';
-            } else {
-                data.packs.forEach(pack => {
-                    const item = Utils.el('div', {
-                        class: 'card',
-                        style: { padding: '12px', marginBottom: '8px', cursor: 'pointer' },
-                        onClick: () => this.loadPack(pack),
-                    });
-                    item.innerHTML = `
-                        <div style="display:flex; justify-content:space-between; align-items:center">
-                            <div>
-                                <div style="font-weight:600">${pack.title}</div>
-                                <div style="font-size:0.8rem; color:var(--text-muted)">${pack.name} &middot; ${pack.sticker_ids?.length || 0} stickers</div>
-                            </div>
-                            <button class="btn btn-ghost btn-sm" data-delete title="Delete"><i class="fas fa-trash"></i></button>
+    async _loadPackPage(list, offset) {
+        const data = await API.listPacks({ sort: 'updated_at', offset });
+
+        if (offset === 0 && (!data.packs || data.packs.length === 0)) {
+            list.innerHTML = '<p style="color:var(--text-muted); text-align:center; padding:20px">No saved packs</p>';
+        } else {
+            data.packs.forEach(pack => {
+                const item = Utils.el('div', {
+                    class: 'card',
+                    style: { padding: '12px', marginBottom: '8px', cursor: 'pointer' },
+                    onClick: () => this.loadPack(pack),
+                });
+                item.innerHTML = `
+                    <div style="display:flex; justify-content:space-between; align-items:center">
+                        <div>
+                            <div style="font-weight:600">${pack.title}</div>
+                            <div style="font-size:0.8rem; color:var(--text-muted)">${pack.name} &middot; ${pack.sticker_ids?.length || 0} stickers</div>
                         </div>
-                    `;
-                    item.querySelector('[data-delete]').addEventListener('click', async (e) => {
-                        e.stopPropagation();
-                        await API.deletePack(pack.pack_id);
-                        item.remove();
-                        Utils.showToast('Pack deleted', 'info');
-                    });
-                    list.appendChild(item);
+                        <button class="btn btn-ghost btn-sm" data-delete title="Delete"><i class="fas fa-trash"></i></button>
+                    </div>
+                `;
+                item.querySelector('[data-delete]').addEventListener('click', async (e) => {
+                    e.stopPropagation();
+                    await API.deletePack(pack.pack_id);
+                    item.remove();
+                    Utils.showToast('Pack deleted', 'info');
                 });
-            }
+                list.appendChild(item);
+            });
+        }
 
-            document.getElementById('packLoadModal').classList.add('active');
-        } catch (err) {
-            Utils.showToast(`Failed to load packs: ${err.message}`, 'error');
+        if (data.next_offset != null) {
+            const more = Utils.el('button', {
+                class: 'btn btn-ghost btn-sm',
+                style: { width: '100%' },
+                text: `Load more (${data.total - data.next_offset} left)`,
+                onClick: async () => {
+                    more.remove();
+                    await this._loadPackPage(list, data.next_offset);
+                },
+            });
+            list.appendChild(more);
         }
     },
 
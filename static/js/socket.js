@@ -27,6 +27,18 @@ const Socket = {
             }
         });
 
+        this._socket.on('archive_progress', (data) => {
+            if (typeof Upload !== 'undefined' && Upload.onArchiveProgress) {
+                Upload.onArchiveProgress(data);
+            }
+        });
+
+        this._socket.on('file_analyzed', (data) => {
+            if (typeof Upload !== 'undefined' && Upload.onFileAnalyzed) {
+                Upload.onFileAnalyzed(data);
+            }
+        });
+
         this._socket.on('file_processed', (data) => {
             if (typeof Upload !== 'undefined' && Upload.onFileProcessed) {
                 Upload.onFileProcessed(data);
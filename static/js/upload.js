@@ -1,5 +1,7 @@
 /* TeleSticker v2 — Upload & Processing */
 
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024;
+
 const Upload = {
     init() {
         this._zone = document.getElementById('uploadZone');
@@ -14,6 +16,9 @@ const Upload = {
         this._progressPercent = document.getElementById('progressPercent');
         this._statusLog = document.getElementById('statusLog');
         this._uploadCount = document.getElementById('uploadCount');
+        this._uploadHint = document.getElementById('uploadHint');
+        this._hintText = this._uploadHint.textContent;
+        this._analyzed = {};
 
         this._setupDragDrop();
         this._setupButtons();
@@ -45,10 +50,18 @@ const Upload = {
         if (!fileList || fileList.length === 0) return;
 
         try {
-            const data = await API.upload(fileList);
+            const sid = AppState.get('sid');
+            const files = Array.from(fileList);
+            // Large files go through the resumable chunked API
+            const small = files.filter(f => f.size <= RESUMABLE_THRESHOLD);
+            const data = small.length ? await API.upload(small, sid) : { files: [] };
+            for (const file of files.filter(f => f.size > RESUMABLE_THRESHOLD)) {
+                const res = await API.uploadResumable(file, sid);
+                data.files.push(...res.files);
+            }
             if (data.files) {
                 for (const f of data.files) {
-                    // Use server thumbnail or generate client-side
+                    // Client-side thumbnail until file_analyzed brings the server one
                     if (!f.thumbnail_url) {
                         const matchingFile = Array.from(fileList).find(
                             file => file.name === f.original_filename
@@ -57,12 +70,16 @@ const Upload = {
                             f._clientThumb = await Utils.generateClientThumbnail(matchingFile);
                         }
                     }
-                    AppState.addSticker(f);
+                    const analyzed = this._analyzed[f.file_id];
+                    delete this._analyzed[f.file_id];
+                    AppState.addSticker(analyzed ? { ...f, ...analyzed } : f);
                 }
                 Utils.showToast(`${data.files.length} file(s) uploaded`, 'success');
             }
         } catch (err) {
             Utils.showToast(`Upload failed: ${err.message}`, 'error');
+        } finally {
+            this._uploadHint.textContent = this._hintText;
         }
     },
 
@@ -215,6 +232,22 @@ const Upload = {
         if (data.message) this._addLog(data.message);
     },
 
+    onArchiveProgress(data) {
+        this._uploadHint.textContent = data.index < data.total
+            ? `Extracting ${data.archive}: ${data.index}/${data.total} (${data.filename})`
+            : this._hintText;
+    },
+
+    onFileAnalyzed(data) {
+        const existing = AppState.get('stickers')[data.file_id];
+        if (!existing) {
+            // Arrived before the upload response was handled
+            this._analyzed[data.file_id] = data;
+            return;
+        }
+        AppState.addSticker({ ...existing, ...data });
+    },
+
     onFileProcessed(data) {
         if (data.status === 'success') {
             this._addLog(`Processed: ${data.processed_name} (${Utils.formatSize(data.size)})`);